@@ -46,62 +46,40 @@ function App() {
 
   // --- Data Fetching & Topic Selection Logic --- *** fetchStructure MODIFIED *** ---
 
-  // Fetches data from backend and TRANSFORMS it into the 3-level folder structure.
+  // Remember the ETag of the last tree we got, so an unchanged tree only costs a 304!
+  const structureEtagRef = useRef(null);
+
+  // Fetches the Subject -> Class -> Topic tree from /structure (the server builds it now, no more full dump!).
   const fetchStructure = useCallback(async (calledFrom = 'unknown') => {
-    console.log(`Fetching raw data from /transcripts...`);
+    console.log(`Fetching structure from /structure (called from: ${calledFrom})...`);
     setIsLoading(true); setError(null);
     try {
-      // --- Fetch the data (expecting an array of notes) ---
-      // TODO: Replace '/api/structure' with `${import.meta.env.VITE_API_BASE_URL}/api/structure` or similar env var.
-      const response = await fetch('http://127.0.0.1:5000/transcripts');
+      // TODO: Replace base URL with env var
+      const headers = structureEtagRef.current ? { 'If-None-Match': structureEtagRef.current } : {};
+      const response = await fetch('http://127.0.0.1:5000/structure', { headers, cache: 'no-store' });
+      if (response.status === 304) {
+          console.log("Structure unchanged (304), keeping the current sidebar.");
+          return;
+      }
       if (!response.ok) {
           let errorMsg = `HTTP error! Status: ${response.status}`;
            try { const errData = await response.json(); errorMsg = errData.error || errData.message || errorMsg; } catch(e) { /* Ignore if not JSON */ }
            throw new Error(errorMsg);
        }
-      const flatNoteList = await response.json(); // Expecting an ARRAY like [{ subject, class, topic, ...}, ...]
-      console.log("Received raw data from http://127.0.0.1:5000/transcripts:", flatNoteList);
-
-      // --- !!! DATA TRANSFORMATION LOGIC !!! ---
-      // Check if we actually got an array
-      if (!Array.isArray(flatNoteList)) {
-          console.error("http://127.0.0.1:5000/transcripts/ did not return an array!", flatNoteList);
+      // Already nested: { subject: { class: { topic: { count, latestUpload } } } }
+      const nestedStructure = await response.json();
+      if (!nestedStructure || typeof nestedStructure !== 'object' || Array.isArray(nestedStructure)) {
+          console.error("/structure did not return an object!", nestedStructure);
           throw new Error("Invalid structure data format received from server.");
       }
+      structureEtagRef.current = response.headers.get('ETag');
 
-      // Build the required nested structure
-      const nestedStructure = {};
-      flatNoteList.forEach(note => {
-          // --- IMPORTANT: Use the CORRECT keys from the backend response ---
-          // Adjust these ('subject', 'class', 'topic') if backend uses different names like 'nameClass'
-          const subject = note.subject;
-          const className = note.class; // Assuming backend sends 'class' key
-          const topicName = note.topic; // Assuming backend sends 'topic' key
-
-          // Ensure all parts exist before adding to structure
-          if (subject && className && topicName) {
-              // Create subject level if it doesn't exist
-              if (!nestedStructure[subject]) {
-                  nestedStructure[subject] = {};
-              }
-              // Create class level if it doesn't exist
-              if (!nestedStructure[subject][className]) {
-                  nestedStructure[subject][className] = {};
-              }
-              // Add topic (empty object signifies its existence in the hierarchy)
-              nestedStructure[subject][className][topicName] = {};
-          } else {
-              // Log a warning if a note is missing necessary fields for structuring
-              console.warn("Skipping note in structure due to missing subject/class/topic:", note);
-          }
-      });
-      // --- !!! END TRANSFORMATION LOGIC !!! ---
-
-      console.log("Transformed nested structure for Sidebar:", nestedStructure);
-      setFolderStructure(nestedStructure || {}); // Update state with the *nested* structure!
+      console.log("Received nested structure for Sidebar:", nestedStructure);
+      setFolderStructure(nestedStructure); // Update state with the *nested* structure!
 
     } catch (err) {
-      console.error("Fetch or transform structure failed!", err); // Log the error!
+      console.error("Fetch structure failed!", err); // Log the error!
+      structureEtagRef.current = null; // Force a full fetch next time.
       setError(`Couldn't load lecture structure: ${err.message}.`); // Tell the user!
       setFolderStructure({}); // Reset structure on error!
     } finally {
@@ -147,6 +125,16 @@ function App() {
 
   // --- Delete Handlers --- (Ensure URLs match backend!)
   // Generic Delete Function (Helper)
+  const waitForDeleteJob = async (jobId) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 2000));
+      const response = await fetch(`http://127.0.0.1:5000/jobs/${jobId}`);
+      if (!response.ok) { throw new Error(`Could not check the delete job. Status: ${response.status}`); }
+      const job = await response.json();
+      if (job.status === 'completed') { return; }
+      if (job.status === 'failed') { throw new Error(job.error || 'The delete job failed'); }
+    }
+  };
   const performDelete = async (url, itemDescription, successCallback) => {
     if (!window.confirm(`Are you sure you want to delete "${itemDescription}"? This action cannot be undone.`)) { return; }
     console.log(`Attempting to DELETE: ${url}`);
@@ -159,6 +147,11 @@ function App() {
           try { const errData = await response.json(); errorMsg = errData.error || errData.message || errorMsg; } catch (e) {}
           throw new Error(errorMsg);
       }
+      // 202: big folders are deleted by a background job, wait for it before reporting success
+      if (response.status === 202) {
+          const { job_id } = await response.json();
+          await waitForDeleteJob(job_id);
+      }
       console.log(`Successfully deleted: ${itemDescription}`);
       alert(`"${itemDescription}" deleted successfully.`);
       if (successCallback) { successCallback(); }
@@ -169,10 +162,10 @@ function App() {
     } finally { setIsDeleting(false); }
   };
   // Specific Delete Handlers
-  const handleDeleteNote = useCallback(async (noteId, noteIdentifier = 'this note') => { const url = `/delete_document/${noteId}`; /* TODO: Base URL */ await performDelete(url, noteIdentifier, () => { if (selectedItem) { const currentSelection = { ...selectedItem }; setSelectedItem(null); setTimeout(() => setSelectedItem(currentSelection), 0); } }); }, [selectedItem]);
-  const handleDeleteTopic = useCallback(async (subject, className, topic) => { const url = `/api/topics?subject=${encodeURIComponent(subject)}&class=${encodeURIComponent(className)}&topic=${encodeURIComponent(topic)}`; /* TODO: Base URL */ const desc = `Topic: ${topic}`; await performDelete(url, desc, () => { if (selectedItem?.subject === subject && selectedItem?.class === className && selectedItem?.topic === topic) { setSelectedItem(null); setCurrentContent(null); } fetchStructure('afterTopicDelete'); }); }, [selectedItem, fetchStructure]);
-  const handleDeleteClass = useCallback(async (subject, className) => { const url = `/api/classes?subject=${encodeURIComponent(subject)}&class=${encodeURIComponent(className)}`; /* TODO: Base URL */ const desc = `Class: ${className}`; await performDelete(url, desc, () => { if (selectedItem?.subject === subject && selectedItem?.class === className) { setSelectedItem(null); setCurrentContent(null); } fetchStructure('afterClassDelete'); }); }, [selectedItem, fetchStructure]);
-  const handleDeleteSubject = useCallback(async (subject) => { const url = `/api/subjects?subject=${encodeURIComponent(subject)}`; /* TODO: Base URL */ const desc = `Subject: ${subject}`; await performDelete(url, desc, () => { if (selectedItem?.subject === subject) { setSelectedItem(null); setCurrentContent(null); } fetchStructure('afterSubjectDelete'); }); }, [selectedItem, fetchStructure]);
+  const handleDeleteNote = useCallback(async (noteId, noteIdentifier = 'this note') => { const url = `http://127.0.0.1:5000/delete_document/${noteId}`; await performDelete(url, noteIdentifier, () => { if (selectedItem) { const currentSelection = { ...selectedItem }; setSelectedItem(null); setTimeout(() => setSelectedItem(currentSelection), 0); } }); }, [selectedItem]);
+  const handleDeleteTopic = useCallback(async (subject, className, topic) => { const url = `http://127.0.0.1:5000/api/topics?subject=${encodeURIComponent(subject)}&class=${encodeURIComponent(className)}&topic=${encodeURIComponent(topic)}`; const desc = `Topic: ${topic}`; await performDelete(url, desc, () => { if (selectedItem?.subject === subject && selectedItem?.class === className && selectedItem?.topic === topic) { setSelectedItem(null); setCurrentContent(null); } fetchStructure('afterTopicDelete'); }); }, [selectedItem, fetchStructure]);
+  const handleDeleteClass = useCallback(async (subject, className) => { const url = `http://127.0.0.1:5000/api/classes?subject=${encodeURIComponent(subject)}&class=${encodeURIComponent(className)}`; const desc = `Class: ${className}`; await performDelete(url, desc, () => { if (selectedItem?.subject === subject && selectedItem?.class === className) { setSelectedItem(null); setCurrentContent(null); } fetchStructure('afterClassDelete'); }); }, [selectedItem, fetchStructure]);
+  const handleDeleteSubject = useCallback(async (subject) => { const url = `http://127.0.0.1:5000/api/subjects?subject=${encodeURIComponent(subject)}`; const desc = `Subject: ${subject}`; await performDelete(url, desc, () => { if (selectedItem?.subject === subject) { setSelectedItem(null); setCurrentContent(null); } fetchStructure('afterSubjectDelete'); }); }, [selectedItem, fetchStructure]);
   // --- End Delete Handlers ---
 
 
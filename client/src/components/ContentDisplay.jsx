@@ -1,4 +1,4 @@
-import React, { useState } from 'react'; // Need useState for collapsible sections!
+import React, { useState, useEffect } from 'react'; // Need useState for collapsible sections!
 // import { FaTrashAlt } from 'react-icons/fa'; // Example icon import if you use one
 
 // --- Sub-Component for Collapsible Section --- Helper! ---
@@ -40,6 +40,50 @@ function CollapsibleSection({ title, children, initiallyCollapsed = false }) { /
 // --- End Collapsible Section Component ---
 
 
+// --- Lazy Transcript --- Only mounted when the Transcript section is expanded! ---
+// /content no longer sends transcripts, so fetch them page by page from /transcript/<id>.
+function TranscriptText({ noteId }) {
+  const [pages, setPages] = useState([]); // Text of every page loaded so far
+  const [pageCount, setPageCount] = useState(null); // Total pages, known after the first fetch
+  const [isLoading, setIsLoading] = useState(false);
+  const [loadError, setLoadError] = useState(null);
+
+  const loadPage = async (page) => {
+    setIsLoading(true);
+    setLoadError(null);
+    try {
+      const response = await fetch(`http://127.0.0.1:5000/transcript/${noteId}?page=${page}`);
+      const data = await response.json();
+      if (!response.ok) throw new Error(data.error || `HTTP error! status: ${response.status}`);
+      setPages(prev => [...prev, data.text]);
+      setPageCount(data.pages);
+    } catch (err) {
+      console.error(`Failed to load transcript page ${page} for ${noteId}:`, err);
+      setLoadError(err.message);
+    } finally {
+      setIsLoading(false);
+    }
+  };
+
+  // Grab the first page as soon as the section opens
+  useEffect(() => { loadPage(0); }, [noteId]); // eslint-disable-line react-hooks/exhaustive-deps
+
+  return (
+    <div className="transcript-area">
+      {pages.join('')}
+      {isLoading && <p><em>Loading transcript...</em></p>}
+      {loadError && <p className="error">Couldn't load the transcript: {loadError}</p>}
+      {!isLoading && pageCount !== null && pages.length < pageCount && (
+        <button className="collapsible-header" onClick={() => loadPage(pages.length)}>
+          Show more ({pages.length} of {pageCount})
+        </button>
+      )}
+    </div>
+  );
+}
+// --- End Lazy Transcript ---
+
+
 // --- Main Content Display Component --- Renders the array of notes! ---
 // Receives the content array, selected item info, loading, error states, and delete handler.
 function ContentDisplay({ content, selectedItem, isLoading, error, onDeleteNote }) {
@@ -193,14 +237,12 @@ function ContentDisplay({ content, selectedItem, isLoading, error, onDeleteNote
 
 
             {/* --- Collapsible Transcript Section --- Display if available --- */}
-            {note.transcript && ( // Check if transcript data exists
+            {note._id && note.transcriptPages > 0 && ( // Check if this note has a stored transcript
                <div className="note-subsection">
                     {/* Use our CollapsibleSection component! Starts collapsed! */}
                     <CollapsibleSection title="Transcript" initiallyCollapsed={true}>
-                        {/* The actual transcript text goes inside a styled div */}
-                        <div className="transcript-area">
-                            {note.transcript}
-                        </div>
+                        {/* Fetched only once the section is opened */}
+                        <TranscriptText noteId={note._id} />
                     </CollapsibleSection>
                </div>
             )}
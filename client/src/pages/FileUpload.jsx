@@ -1,6 +1,83 @@
 import React, { useState } from 'react'; // Still need useState!
 import axios from 'axios'; // Axios for those sweet HTTP requests!
 
+// How often we ask the backend how the upload job is doing (ms).
+const JOB_POLL_INTERVAL = 2000;
+
+// Files go up in 8MB chunks so big lecture videos don't time out, and a failed chunk is simply resent!
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const MAX_CHUNK_ATTEMPTS = 3;
+const MAX_COMPLETE_ATTEMPTS = 5;
+
+// SHA-256 of a chunk as hex, the backend checks it before accepting the chunk.
+const sha256Hex = async (blob) => {
+  const hash = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2, '0')).join('');
+};
+
+// Opens an upload session, sends every missing chunk, and returns the job id the backend starts after the last one.
+const uploadInChunks = async (file) => {
+  const init = await axios.post('http://localhost:5000/uploads', { filename: file.name, size: file.size, chunkSize: CHUNK_SIZE });
+  let session = init.data;
+  let stopSending = false;
+  for (const index of session.missingChunks) {
+    if (stopSending) break;
+    const chunk = file.slice(index * CHUNK_SIZE, Math.min(file.size, (index + 1) * CHUNK_SIZE));
+    const checksum = await sha256Hex(chunk);
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const res = await axios.put(`http://localhost:5000/uploads/${session.upload_id}/chunks/${index}`, chunk, {
+          headers: { 'Content-Type': 'application/octet-stream', 'X-Chunk-Sha256': checksum },
+        });
+        session = res.data;
+        console.log(`Chunk ${index + 1}/${session.totalChunks} uploaded`);
+        break;
+      } catch (err) {
+        const status = err.response?.status;
+        // 409: the upload is already complete, an earlier try of the last chunk landed but its answer got lost
+        if (status === 409) { stopSending = true; break; }
+        const retryable = !status || status >= 500 || status === 422; // Network hiccup or corrupted chunk? Try again!
+        if (!retryable || attempt >= MAX_CHUNK_ATTEMPTS) {
+          // 503: the last chunk is stored but the job queue was full, finishUpload sorts it out below
+          if (status === 503) { stopSending = true; break; }
+          throw err;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+      }
+    }
+  }
+  return session.job_id || finishUpload(session.upload_id);
+};
+
+// Asks the backend where the upload stands and makes sure a job gets started for it.
+const finishUpload = async (uploadId) => {
+  for (let attempt = 1; ; attempt++) {
+    const { data: state } = await axios.get(`http://localhost:5000/uploads/${uploadId}`);
+    if (state.job_id) return state.job_id;
+    if (state.missingChunks.length > 0) throw new Error(`${state.missingChunks.length} chunk(s) never arrived, please upload again`);
+    try {
+      const res = await axios.post(`http://localhost:5000/uploads/${uploadId}/complete`);
+      return res.data.job_id;
+    } catch (err) {
+      // 503 means the job queue is full right now, wait a bit and ask again
+      if (err.response?.status !== 503 || attempt >= MAX_COMPLETE_ATTEMPTS) throw err;
+      await new Promise(resolve => setTimeout(resolve, 5000 * attempt));
+    }
+  }
+};
+
+// Uploads are processed in the background now! Keep asking /jobs/<id> until it finishes or fails.
+const waitForJob = async (jobId) => {
+  while (true) {
+    const res = await axios.get(`http://localhost:5000/jobs/${jobId}`);
+    const job = res.data;
+    console.log(`Job ${jobId} is ${job.status} (stage: ${job.currentStage || '-'})`);
+    if (job.status === 'completed') return job;
+    if (job.status === 'failed') throw new Error(job.error || 'Processing failed');
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+  }
+};
+
 // This component handles BOTH file uploads AND URL submissions now! Double duty!
 function FileUpload({ onUploadSuccess }) {
   // === State Variables ===
@@ -27,18 +104,14 @@ function FileUpload({ onUploadSuccess }) {
   const handleUploadFile = async () => {
     if (!file) return; // Should already be handled by button disable, but belt and braces!
 
-    console.log("Uploading FILE via axios to http://localhost:5000/upload ...");
+    console.log("Uploading FILE in chunks via axios to http://localhost:5000/uploads ...");
     setIsUploading(true); // We're busy!
     
-    const formData = new FormData(); // File needs FormData!
-    formData.append('file', file); // Key 'file' must match backend!
-
     try {
-      const res = await axios.post('http://localhost:5000/upload_file', formData, {
-        headers: { 'Content-Type': 'multipart/form-data' }, // Tell backend it's a file!
-      });
-      console.log("File upload response:", res.data);
-      alert('File uploaded successfully! 🎉 Backend says: ' + res.data);
+      const jobId = await uploadInChunks(file); // Chunked + checksummed upload!
+      console.log("File upload finished, job:", jobId);
+      const job = await waitForJob(jobId); // Wait for the background pipeline!
+      alert('File processed successfully! 🎉 Document id: ' + job.inserted_id);
       if (onUploadSuccess) onUploadSuccess(); // Tell App.jsx to refresh!
       setFile(null); // Clear the file state
     } catch (err) {
@@ -64,7 +137,8 @@ function FileUpload({ onUploadSuccess }) {
       console.log("Payload for URL submission:", payload);
       const res = await axios.post('http://localhost:5000/upload_link', {"link": payload.url});
       console.log("URL submission response:", res.data);
-      alert('URL submitted successfully! 👍 Backend says: ' + res.data);
+      const job = await waitForJob(res.data.job_id); // Wait for the background pipeline!
+      alert('URL processed successfully! 👍 Document id: ' + job.inserted_id);
       if (onUploadSuccess) onUploadSuccess(); // Tell App.jsx to refresh!
       setUrlInput(""); // Clear the URL input state
     } catch (err) {
@@ -1,5 +1,4 @@
-from flask import Flask, request, jsonify
-import requests
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 #Library for .env variable access
 from dotenv import load_dotenv
@@ -7,23 +6,20 @@ from dotenv import load_dotenv
 import logging
 #For manipulating paths
 import os
-#For transcriptions 
-import assemblyai as aai
-#for audio download from youtube link
-import yt_dlp
+import time
+import uuid
+import threading
+from itertools import islice
 from config.db import db
+from services import metrics, jobs, fingerprints, structure, search_index, media, uploads, transcripts, background
+from services.analysis import extract_keywords, PROMPT_VERSION
+from services.extraction import iter_text_chunks
+from services.resources import search_resources, invalidate_cached
 from datetime import datetime
-#Regex to search for pattern
-import re
-#import google generative
-import google.generativeai as gen_ai
 
 #Import ObjectId from the bson package (part of pymongo).
 from bson import ObjectId
-import fitz  # PyMuPDF
-import pdfplumber
-import docx
-from moviepy import VideoFileClip
+from bson.errors import InvalidId
 
 
 
@@ -33,33 +29,34 @@ logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
 #Allow connection with frontend
-CORS(app, origins=['http://localhost:5173'])
+CORS(app, origins=['http://localhost:5173'], expose_headers=['ETag'])
 
 
 
-UPLOAD_FOLDER = 'uploads'
+UPLOAD_FOLDER = uploads.UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'mp4', 'mov'}
 
 
 load_dotenv()
 
-#create an audio folder if not exist
-os.makedirs("audio", exist_ok=True)
+#create an audio folder if not exist, every job gets its own workspace inside it
+os.makedirs(media.WORKSPACE_ROOT, exist_ok=True)
 
-#Added Generative AI agent
-gen_ai.configure(api_key=os.getenv("GEN_AI"))
+# Created on the first transcription, importing AssemblyAI slows down worker startup
+transcriber = None
+_transcriber_lock = threading.Lock()
 
-# API Token for Assembly AI
-aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
-
-#Google API Key for web searching
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-#Something ..
-GOOGLE_CSE_ID = os.getenv('GOOGLE_CSE_ID')
-
-# Create a transcriber object.
-transcriber = aai.Transcriber()
+def get_transcriber():
+    global transcriber
+    with _transcriber_lock:
+        if transcriber is None:
+            #For transcriptions
+            import assemblyai as aai
+            # API Token for Assembly AI
+            aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
+            transcriber = aai.Transcriber()
+        return transcriber
 
 #==========================UPLOAD PDF, DOCX========================
 @app.route('/upload_file', methods=['POST'])
@@ -72,79 +69,156 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
 
     #extract the extention of the file and check if it's part of the list defined above
-    ext = file.filename.rsplit('.', 1)[1].lower()
+    ext = file.filename.rsplit('.', 1)[-1].lower()
     if ext not in ALLOWED_EXTENSIONS:
         return jsonify({'error': 'File type not allowed'}), 400
 
     try:
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
+        #Never trust the client's filename as a path, the pipeline deletes the file when it's done
+        file_path = uploads.final_path(uuid.uuid4().hex, ext)
         file.save(file_path)
-
-        extracted_text = ""
-
-        if ext == 'pdf':
-            extracted_text = extract_pdf(file_path)
-        elif ext == 'docx':
-            extracted_text = extract_docx(file_path)
-        elif ext in ['mp4', 'mov']:
-            extracted_text = transcribe_video(file_path)
-
-        if not extracted_text:
-            return jsonify({'error': 'Failed to extract text'}), 500
-
-        # Continue your existing pipeline:
-        # extract_keywords() -> store in MongoDB
-        content = extract_keywords(extracted_text)
-        document = {
-            'uploadDate': datetime.now(),
-            'topicsCovered': content["subtopics"],
-            'summary': content["summary"],
-            'structuredResources': search_resources(content["subtopics"]),
-            'transcript': extracted_text,
-            'subject': content["subject"],
-            'class': content["class"],
-            'topic': content["topic"],
-        }
-        result = db.Documents.insert_one(document)
-        logging.info(f"Inserted document ID: {result.inserted_id}")
-
-
-        logging.info("Temporary files cleaned up")
-        return jsonify({
-            "success": True,
-            "inserted_id": str(result.inserted_id)
-        })
+        #The pipeline runs in the background, the client polls /jobs/<id> for progress
+        #reanalyze=true reuses a cached transcript but runs the analysis again
+        reanalyze = request.form.get('reanalyze', '').lower() in ('1', 'true')
+        job = submit_file_job(file_path, ext, reanalyze)
+        return jsonify({"job_id": job["_id"], "status": job["status"]}), 202
+    except jobs.QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         return jsonify({"error": str(e)}), 500
 
+def submit_file_job(file_path, ext, reanalyze=False):
+    return jobs.submit_job("upload_file", {"file_path": file_path, "ext": ext, "reanalyze": reanalyze})
+
+#==========================CHUNKED UPLOADS========================
+#Big videos are sent in chunks: POST /uploads, PUT /uploads/<id>/chunks/<n> (with X-Chunk-Sha256),
+#GET /uploads/<id> to see what's missing after a dropped connection. Processing starts as soon
+#as the last chunk arrives, POST /uploads/<id>/complete is only needed with autoComplete=false.
+
+def _start_upload_job(session, retry=False):
+    file_path = uploads.finish(session["_id"])
+    if file_path is None:
+        #Another request already finished this upload. An explicit /complete may still
+        #start the job if the first attempt found the queue full
+        current = uploads.get_session(session["_id"])
+        if current.get("jobId") or not retry:
+            return current.get("jobId")
+        file_path = uploads.final_path(session["_id"], session["ext"])
+    job = submit_file_job(file_path, session["ext"], session.get("reanalyze", False))
+    uploads.set_job(session["_id"], job["_id"])
+    return job["_id"]
+
+@app.route('/uploads', methods=['POST'])
+def init_upload():
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    ext = filename.rsplit('.', 1)[-1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        return jsonify({'error': 'File type not allowed'}), 400
+    try:
+        session = uploads.create_session(
+            filename, ext, int(data.get('size', 0)),
+            chunk_size=data.get('chunkSize'), sha256=data.get('sha256'),
+        )
+        fields = {"reanalyze": bool(data.get('reanalyze')), "autoComplete": data.get('autoComplete', True)}
+        db.UploadSessions.update_one({"_id": session["_id"]}, {"$set": fields})
+        return jsonify(uploads.serialize_session(session)), 201
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid upload parameters: {e}"}), 400
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    try:
+        return jsonify(uploads.serialize_session(uploads.get_session(upload_id))), 200
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
 
-    return jsonify({'message': 'File processed successfully', 'extracted_text': extracted_text})
-
-def extract_pdf(path):
-    text = ""
-    with pdfplumber.open(path) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-    return text
-
-def extract_docx(path):
-    doc = docx.Document(path)
-    return "\n".join([para.text for para in doc.paragraphs])
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_chunk(upload_id, index):
+    try:
+        session = uploads.write_chunk(upload_id, index, request.stream, request.headers.get('X-Chunk-Sha256'))
+        response = uploads.serialize_session(session)
+        if not response["missingChunks"] and session.get("autoComplete", True):
+            response["job_id"] = _start_upload_job(session)
+        return jsonify(response), 200
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except jobs.QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    try:
+        job_id = _start_upload_job(uploads.get_session(upload_id), retry=True)
+        #The upload may have been completed before, report where its job actually stands
+        job = jobs.get_job(job_id)
+        if job is None:
+            return jsonify({"error": "The upload's job no longer exists, please upload again"}), 404
+        body = {"job_id": job_id, "status": job["status"]}
+        if job["status"] == jobs.FAILED:
+            body["error"] = job.get("error")
+            body["retry"] = f"/jobs/{job_id}/retry"
+        return jsonify(body), 202 if job["status"] in jobs.PENDING_STATUSES else 200
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except jobs.QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+
+def check_transcript(transcript):
+    #TranscriptStatus is a str enum, so no need to import assemblyai for this
+    if transcript.status == "error":
+        raise RuntimeError(f"Transcription failed: {transcript.error}")
+    logging.info("Transcription completed")
+    return transcript.text
 
 def transcribe_video(path):
-    audio_path = path.replace('.mp4', '.wav').replace('.mov', '.wav')
-    clip = VideoFileClip(path)
-    clip.audio.write_audiofile(audio_path)
-    transcript = transcriber.transcribe(audio_path)
-    clean_up(audio_path)
-    return transcript.text
+    #ffmpeg streams the audio track straight into the AssemblyAI upload, nothing is decoded to disk
+    return check_transcript(media.transcribe_media(get_transcriber(), path))
 
 #==========================UPLOAD PDF, DOCX========================
 
 
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        #Use the route pattern, not the raw path, so ids don't blow up the label count
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                     endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 #Home route
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    #Liveness: the worker answers requests, nothing else is checked
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    #Readiness: MongoDB answers; the search index snapshot is opened in the background and doesn't block
+    #traffic (/search answers 503 until the first one is written)
+    checks = {"searchIndex": search_index.is_ready(), "backgroundLead": background.is_lead()}
+    try:
+        db.command("ping")
+        checks["mongo"] = True
+    except Exception as e:
+        logging.error(f"Readiness check failed: {e}")
+        checks["mongo"] = False
+    return jsonify({"status": "ready" if checks["mongo"] else "unavailable", "checks": checks}), 200 if checks["mongo"] else 503
+
 @app.route("/")
 def home():
     return {"msg": "Flask server is up"}
@@ -153,27 +227,131 @@ def home():
 @app.route('/upload_link', methods=['POST'])
 def upload_link():
     #Get the video url sent from front end
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     video_url = data.get('link')
-    #This is the path of where to store the audio. Audio will be named audio1
-    output_path = os.path.join('audio', 'audio1')
+    if not video_url:
+        return jsonify({"error": "Missing link"}), 400
     try:
-        logging.info(f"Downloading audio from: {video_url}")
-        #Download the audio files to audio folder by calling download_audio function
-        download_audio(video_url, output_path)
-        logging.info(f"Audio downloaded to: {output_path}")
-        #Get transcription from the file path
-        return transcribe(output_path)
+        #Download, transcription and analysis run in the background, the client polls /jobs/<id>
+        job = jobs.submit_job("upload_link", {"link": video_url, "reanalyze": bool(data.get('reanalyze'))})
+        return jsonify({"job_id": job["_id"], "status": job["status"]}), 202
+    except jobs.QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(jobs.serialize_job(job)), 200
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    #Runs a failed job again from the stage that failed, its files are kept for FAILED_JOB_RETRY_HOURS
+    try:
+        job = jobs.retry_job(job_id)
+    except jobs.QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    if job is None:
+        if jobs.get_job(job_id) is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify({"error": f"Only jobs that failed in the last {jobs.FAILED_JOB_RETRY_HOURS:g} hours can be retried"}), 409
+    return jsonify({"job_id": job_id, "status": jobs.QUEUED}), 202
+
+@app.route('/jobs', methods=['GET'])
+def get_jobs():
+    status = request.args.get('status')
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    return jsonify([jobs.serialize_job(job) for job in jobs.list_jobs(status, limit)]), 200
+
+#Max number of documents returned by one /transcripts page
+TRANSCRIPTS_PAGE_LIMIT = 500
+#Documents whose transcripts are fetched from the store together
+TRANSCRIPTS_BATCH_SIZE = 50
+#What ?fields= may ask for; checked up front since a bad projection would only fail mid-stream
+TRANSCRIPTS_FIELDS = {
+    "_id", "subject", "class", "topic", "summary", "topicsCovered", "structuredResources", "transcript",
+    "transcriptLength", "transcriptPages", "uploadDate", "updatedAt", "jobId", "importedFrom", "stageTimings",
+}
+
 @app.route('/transcripts', methods=['GET'])
 def get_all_transcripts():
-    documents = list(db.Documents.find())
-    for doc in documents:
-        doc["_id"] = str(doc["_id"])  # Make it JSON serializable
-    return jsonify(documents)
+    #?fields=subject,class,topic only returns those fields
+    #?limit=100&after=<last _id of the previous page> pages through the collection
+    try:
+        limit = min(max(request.args.get('limit', 100, type=int), 1), TRANSCRIPTS_PAGE_LIMIT)
+        after = request.args.get('after')
+        query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+        fields = request.args.get('fields')
+        projection = {field.strip(): 1 for field in fields.split(',') if field.strip()} if fields else None
+    except Exception as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+    unknown = sorted(set(projection or ()) - TRANSCRIPTS_FIELDS)
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    cursor = db.Documents.find(query, projection).sort("_id", 1).limit(limit).batch_size(TRANSCRIPTS_BATCH_SIZE)
+    with_transcript = projection is None or "transcript" in projection
+    try:
+        #The first batch is read before the 200 goes out, so a failing query still gets a proper error
+        first = list(islice(cursor, TRANSCRIPTS_BATCH_SIZE))
+    except Exception as e:
+        logging.error(f"Listing transcripts failed: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    #Stream the array one batch at a time instead of building it all in memory
+    def generate():
+        yield "["
+        index = 0
+        batch = first
+        while batch:
+            texts = transcripts.load_many([doc["_id"] for doc in batch]) if with_transcript else {}
+            for doc in batch:
+                doc["_id"] = str(doc["_id"])  # Make it JSON serializable
+                if with_transcript:
+                    doc["transcript"] = texts.get(doc["_id"], "")
+                yield ("," if index else "") + app.json.dumps(doc)
+                index += 1
+            batch = list(islice(cursor, TRANSCRIPTS_BATCH_SIZE))
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/transcript/<_id>', methods=['GET'])
+def get_transcript(_id):
+    #?page=0,1,... returns one page of the transcript, "pages" says how many there are
+    try:
+        page = request.args.get('page', 0, type=int)
+        if page < 0:
+            return jsonify({"error": "page must be 0 or more"}), 400
+        result = transcripts.get_page(_id, page)
+    except InvalidId:
+        return jsonify({"error": "Invalid document id"}), 400
+    except Exception as e:
+        logging.error(f"Error reading transcript {_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    if result is None:
+        return jsonify({"error": "Transcript page not found"}), 404
+    result["_id"] = _id
+    response = jsonify(result)
+    #A transcript only changes if the document is deleted and re-uploaded under a new id
+    response.headers["Cache-Control"] = "private, max-age=3600"
+    return response, 200
+
+@app.route('/structure', methods=['GET'])
+def get_structure():
+    #Only the Subject -> Class -> Topic tree with counts, answers 304 when the client's copy is current
+    try:
+        tree, etag = structure.get_structure()
+        response = jsonify(tree)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+    except Exception as e:
+        logging.error(f"Error building structure: {e}")
+        return jsonify({"error": str(e)}), 500
 
 
 @app.route('/content', methods=['GET'])
@@ -195,7 +373,8 @@ def get_content_by_subject_class_topic():
             "topic": topic
         }
         print(f"Querying MongoDB with: {query}")
-        results = list(db.Documents.find(query))
+        #Transcripts are loaded separately from /transcript/<id> when the user expands one
+        results = list(db.Documents.find(query, {"transcript": 0}).sort("uploadDate", -1))
 
         # Convert ObjectId to string for frontend compatibility
         for r in results:
@@ -207,6 +386,78 @@ def get_content_by_subject_class_topic():
         print("Error in /content:", str(e))
         return jsonify({"error": str(e)}), 500
 
+
+@app.route('/search', methods=['GET'])
+def search_lectures():
+    #?q=recursion "base case" -> BM25 ranked lectures, quoted words must appear as a phrase
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing q"}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    try:
+        started = time.perf_counter()
+        search_index.ensure_ready()
+        hits = search_index.search(query, limit)
+        took_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        #Only fetch the few documents we show, for their labels and snippet text
+        ids = [ObjectId(doc_id) for doc_id, _ in hits]
+        docs = {str(doc["_id"]): doc for doc in db.Documents.find(
+            {"_id": {"$in": ids}},
+            {"subject": 1, "class": 1, "topic": 1, "uploadDate": 1, "summary": 1, "topicsCovered": 1},
+        )}
+        results = []
+        for doc_id, score in hits:
+            doc = docs.get(doc_id)
+            if doc is None:
+                continue
+            results.append({
+                "_id": doc_id,
+                "subject": doc.get("subject"),
+                "class": doc.get("class"),
+                "topic": doc.get("topic"),
+                "uploadDate": doc.get("uploadDate"),
+                "score": round(score, 4),
+                "snippet": lecture_snippet(doc, query),
+            })
+        return jsonify({"query": query, "took_ms": took_ms, "results": results}), 200
+    except search_index.IndexNotReadyError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logging.error(f"Search failed: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def lecture_snippet(doc, query):
+    #Try the summary and topics first, only decompress the transcript when they don't match
+    text = search_index.snippet(search_index.document_text(doc), query)
+    if not text:
+        doc["transcript"] = transcripts.load(doc["_id"]) or ""
+        text = search_index.snippet(search_index.document_text(doc), query)
+    return text
+
+@app.route('/related/<_id>', methods=['GET'])
+def related_lectures(_id):
+    limit = min(max(request.args.get('limit', 5, type=int), 1), 20)
+    try:
+        search_index.ensure_ready()
+        hits = search_index.related(_id, limit)
+    except search_index.IndexNotReadyError as e:
+        return jsonify({"error": str(e)}), 503
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+    docs = {str(doc["_id"]): doc for doc in db.Documents.find(
+        {"_id": {"$in": [ObjectId(doc_id) for doc_id, _ in hits]}},
+        {"subject": 1, "class": 1, "topic": 1, "summary": 1},
+    )}
+    results = []
+    for doc_id, similarity in hits:
+        if doc_id in docs:
+            doc = docs[doc_id]
+            doc["_id"] = doc_id
+            doc["similarity"] = round(similarity, 4)
+            results.append(doc)
+    return jsonify(results), 200
+
     
 @app.route("/delete_document/<_id>", methods=['DELETE'])
 def delete_document(_id):
@@ -215,187 +466,284 @@ def delete_document(_id):
         result = db.Documents.delete_one({"_id": ObjectId(_id)}) # {"_id": ObjectId("4d512b45cc9374271b02ec4f")
         if result.deleted_count == 0:
             return jsonify({"error": "Document not found"}), 404
+        fingerprints.unlink_documents([_id])
+        transcripts.delete([_id])
+        search_index.delete_documents([_id])
+        structure.invalidate()
         return jsonify({"message": "Document deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
    
    
-#Download audio from the video uploaded
-def download_audio(video_url, output_path):
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': output_path,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'wav',
-            'preferredquality': '192',
-        }],
+#==========================BULK DELETE========================
+#Folders with more documents than this are deleted by a background job
+BULK_DELETE_BACKGROUND_THRESHOLD = 500
+
+def delete_folder(query):
+    #Grab what we need to clean up caches, then remove exactly those documents with one delete_many.
+    #Deleting by id rather than by query leaves a lecture uploaded into the folder meanwhile alone,
+    #instead of deleting it without cleaning up after it.
+    docs = list(db.Documents.find(query, {"_id": 1, "class": 1, "topic": 1, "topicsCovered": 1}))
+    result = db.Documents.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+
+    doc_ids = [str(doc["_id"]) for doc in docs]
+    fingerprints.unlink_documents(doc_ids)
+    transcripts.delete(doc_ids)
+    search_index.delete_documents(doc_ids)
+    invalidate_cached({t for doc in docs for t in (doc.get("topicsCovered") or [])})
+    structure.invalidate()
+    return {
+        "documents": result.deleted_count,
+        "classes": len({doc.get("class") for doc in docs}),
+        "topics": len({(doc.get("class"), doc.get("topic")) for doc in docs}),
     }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([video_url])   
-     
-#Transcribe the data and remove it after get the transcription
-def transcribe(audio_path):
-    try:
-        #audio_path doesn't include the file type, so we have to use string concatenation to add ".wav"
-        transcript = transcriber.transcribe(audio_path + ".wav")
-        logging.info("Transcription completed")
-        #Delete the audio file from the folder
-        clean_up(audio_path + ".wav")
-        
-        #The recommendation given by Google AI
-        content = extract_keywords(transcript.text)
-        # result_content = {
-        #     "subject": subject,
-        #     "class": class_name,
-        #     "topic": topic,
-        #     "subtopics": subtopics,
-        #     "summary": summary
-        # }
-        document = {
-            'uploadDate': datetime.now(),
-            'topicsCovered': content["subtopics"],
-            'summary': content["summary"],
-            'structuredResources': search_resources(content["subtopics"]),
-            'transcript': transcript.text,
-            'subject': content["subject"],
-            'class': content["class"],
-            'topic': content["topic"],
-        }
-        result = db.Documents.insert_one(document)
-        logging.info(f"Inserted document ID: {result.inserted_id}")
 
-        
-        #Generating creating summary from the transcription
-        
-        #Add summary to mongoDB
-        
-        logging.info("Temporary files cleaned up")
-        return jsonify({
-            "transcript": transcript.text,
-            "inserted_id": str(result.inserted_id)
-            })
+def stage_bulk_delete(job):
+    return {"deleted": delete_folder(job["params"]["query"])}
+
+jobs.register_pipeline("bulk_delete", [("delete", stage_bulk_delete)])
+
+def handle_folder_delete(query):
+    try:
+        run_in_background = request.args.get('background', '').lower() in ('1', 'true')
+        if run_in_background or db.Documents.count_documents(query) > BULK_DELETE_BACKGROUND_THRESHOLD:
+            job = jobs.submit_job("bulk_delete", {"query": query})
+            return jsonify({"job_id": job["_id"], "status": job["status"]}), 202
+
+        deleted = delete_folder(query)
+        if deleted["documents"] == 0:
+            return jsonify({"error": "Folder not found"}), 404
+        return jsonify({"message": "Folder deleted successfully", "deleted": deleted}), 200
+    except jobs.QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        logging.error(f"An error occurred: {e}")
+        logging.error(f"Bulk delete failed: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/topics', methods=['DELETE'])
+def delete_topic():
+    subject = request.args.get('subject')
+    class_name = request.args.get('class')
+    topic = request.args.get('topic')
+    if not subject or not class_name or not topic:
+        return jsonify({"error": "Missing subject, class, or topic"}), 400
+    return handle_folder_delete({"subject": subject, "class": class_name, "topic": topic})
+
+@app.route('/api/classes', methods=['DELETE'])
+def delete_class():
+    subject = request.args.get('subject')
+    class_name = request.args.get('class')
+    if not subject or not class_name:
+        return jsonify({"error": "Missing subject or class"}), 400
+    return handle_folder_delete({"subject": subject, "class": class_name})
+
+@app.route('/api/subjects', methods=['DELETE'])
+def delete_subject():
+    subject = request.args.get('subject')
+    if not subject:
+        return jsonify({"error": "Missing subject"}), 400
+    return handle_folder_delete({"subject": subject})
+
+
+#==========================PIPELINE STAGES========================
+#Each stage gets the job document and returns what it produced, which is saved on the job.
+#If the server restarts, the job picks up at the first stage that did not complete.
+
+def _skip_if_done(job, *keys):
+    #A stage is skipped when an earlier stage (or the fingerprint cache) already produced its output
+    if any(key in job["data"] for key in keys):
+        raise jobs.SkipStage()
+
+def _reuse_fingerprint(job, key):
+    #The document id is picked here and saved on the job, so a store stage that is resumed
+    #after a crash writes the same document and transcript again instead of a second copy
+    updates = {"fingerprint": key, "document_id": str(ObjectId())}
+    entry = fingerprints.lookup(key)
+    if entry is None:
+        return updates
+
+    reanalyze = job["params"].get("reanalyze", False)
+    document_id = entry.get("documentId")
+    if document_id and db.Documents.count_documents({"_id": ObjectId(document_id)}, limit=1):
+        if not reanalyze:
+            logging.info(f"Duplicate upload, reusing document {document_id}")
+            updates.update({"inserted_id": document_id, "duplicate": True})
+            return updates
+        #Re-analysis refreshes the existing document instead of adding a second copy
+        updates.update({"replace_document": document_id, "document_id": document_id})
+
+    transcript_id = entry.get("transcriptId")
+    transcript_info = transcripts.summary(transcript_id) if transcript_id else None
+    if transcript_info is not None and "replace_document" not in updates:
+        #Left by an earlier upload that failed before storing its document, finish it under that id
+        updates["document_id"] = transcript_id
+    if transcript_info is not None and transcript_id == updates["document_id"]:
+        logging.info("Reusing cached transcript")
+        updates["transcript_info"] = transcript_info
+    if not reanalyze and entry.get("analysis") and entry.get("promptVersion") == PROMPT_VERSION:
+        updates["content"] = entry["analysis"]
+    return updates
+
+def stage_fingerprint_link(job):
+    return _reuse_fingerprint(job, fingerprints.link_key(job["params"]["link"]))
+
+def stage_fingerprint_file(job):
+    file_path = job["params"]["file_path"]
+    updates = _reuse_fingerprint(job, fingerprints.file_key(file_path))
+    if "transcript_info" in updates:
+        #We already have the text of this file, no need to keep a second copy around
+        clean_up(file_path)
+    return updates
+
+def _save_transcript(job, pieces):
+    #The text goes straight to the transcript store under the job's document id; the job and
+    #the fingerprint only keep a reference. Jobs queued before the fingerprint stage picked an
+    #id get one here
+    document_id = job["data"].get("document_id") or str(ObjectId())
+    with metrics.external_call("mongo"):
+        transcript_info = transcripts.save_stream(document_id, pieces)
+    if not transcript_info["transcriptLength"]:
+        raise RuntimeError("Failed to extract text")
+    fingerprints.save_transcript(job["data"]["fingerprint"], document_id)
+    return {"document_id": document_id, "transcript_info": transcript_info}
+
+def _iter_transcript(job):
+    #Jobs queued before the transcript store still carry the text themselves
+    if "transcript" in job["data"]:
+        return [job["data"]["transcript"]]
+    return transcripts.iter_text(job["data"]["document_id"])
+
+def _load_transcript(job):
+    with metrics.external_call("mongo"):
+        return "".join(_iter_transcript(job))
+
+def stage_download(job):
+    _skip_if_done(job, "transcript", "transcript_info", "inserted_id")
+    #Each job downloads into its own workspace so concurrent uploads don't overwrite each other
+    directory = media.workspace_path(job["_id"])
+    logging.info(f"Downloading audio from: {job['params']['link']}")
+    audio_path = media.download_audio(job["params"]["link"], directory)
+    logging.info(f"Audio downloaded to: {audio_path}")
+    return {"audio_path": audio_path}
+
+def stage_transcribe(job):
+    _skip_if_done(job, "transcript", "transcript_info", "inserted_id")
+    audio_path = job["data"]["audio_path"]
+    with metrics.external_call("assemblyai"):
+        transcript = get_transcriber().transcribe(audio_path)
+    text = check_transcript(transcript)
+    #Delete the audio, the workspace itself goes when the job finishes
+    clean_up(audio_path)
+    return _save_transcript(job, [text])
+
+def stage_extract(job):
+    _skip_if_done(job, "transcript", "transcript_info", "inserted_id")
+    file_path = job["params"]["file_path"]
+    ext = job["params"]["ext"]
+    if ext in ['pdf', 'docx']:
+        #Pages are compressed into the store as they're read, the document is never joined
+        pieces = iter_text_chunks(file_path, ext)
+    elif ext in ['mp4', 'mov']:
+        pieces = [transcribe_video(file_path) or ""]
+    else:
+        raise RuntimeError(f"Can't extract text from .{ext} files")
+    return _save_transcript(job, pieces)
+
+def stage_analyze(job):
+    _skip_if_done(job, "content", "inserted_id")
+    #The recommendation given by Google AI; reanalyze=true bypasses the analysis cache as well
+    #The stored transcript is read back page by page and cut into analysis chunks as it goes
+    content = extract_keywords(_iter_transcript(job), fresh=job["params"].get("reanalyze", False))
+    fingerprints.save_analysis(job["data"]["fingerprint"], content, PROMPT_VERSION)
+    return {"content": content}
+
+def stage_resources(job):
+    _skip_if_done(job, "inserted_id")
+    return {"resources": search_resources(job["data"]["content"]["subtopics"])}
+
+def stage_store(job):
+    _skip_if_done(job, "inserted_id")
+    content = job["data"]["content"]
+    replace_id = job["data"].get("replace_document")
+    #The id comes from the fingerprint stage, so the transcript is stored before the document
+    #points to it and running this stage twice writes the same records (jobs queued before
+    #the fingerprint stage picked one fall back to a new id)
+    document_id = ObjectId(job["data"].get("document_id") or replace_id or ObjectId())
+    transcript_info = job["data"].get("transcript_info")
+    if transcript_info is None:
+        with metrics.external_call("mongo"):
+            transcript_info = transcripts.save(document_id, job["data"]["transcript"])
+    document = {
+        'topicsCovered': content["subtopics"],
+        'summary': content["summary"],
+        'structuredResources': job["data"]["resources"],
+        **transcript_info,
+        'subject': content["subject"],
+        'class': content["class"],
+        'topic': content["topic"],
+        'jobId': job["_id"],
+        #Lets every server's search index notice a re-analyzed lecture (see services.search_index)
+        'updatedAt': datetime.now(),
+        #How long each earlier stage of this upload took, for digging into slow lectures later
+        'stageTimings': {s["name"]: s["durationSeconds"] for s in job["stages"] if "durationSeconds" in s},
+    }
+    with metrics.external_call("mongo"):
+        #An upsert rather than insert_one, in case a crashed attempt already inserted it.
+        #Documents from before the transcript store still carry their own copy, hence the $unset
+        db.Documents.update_one(
+            {"_id": document_id},
+            {"$set": document, "$unset": {"transcript": ""}, "$setOnInsert": {"uploadDate": datetime.now()}},
+            upsert=True,
+        )
+    if replace_id:
+        logging.info(f"Re-analyzed document ID: {replace_id}")
+    else:
+        logging.info(f"Inserted document ID: {document_id}")
+    document_id = str(document_id)
+    fingerprints.link_document(job["data"]["fingerprint"], document_id)
+    document["_id"] = document_id
+    document["transcript"] = _load_transcript(job)
+    search_index.add_document(document)
+    structure.invalidate()
+    return {"inserted_id": document_id}
+
+jobs.register_pipeline("upload_link", [
+    ("fingerprint", stage_fingerprint_link),
+    ("download", stage_download),
+    ("transcribe", stage_transcribe),
+    ("analyze", stage_analyze),
+    ("resources", stage_resources),
+    ("store", stage_store),
+], on_finish=lambda job: media.remove_workspace(job["_id"]))
+jobs.register_pipeline("upload_file", [
+    ("fingerprint", stage_fingerprint_file),
+    ("extract", stage_extract),
+    ("analyze", stage_analyze),
+    ("resources", stage_resources),
+    ("store", stage_store),
+], on_finish=lambda job: clean_up(job["params"]["file_path"]))
+
 #Delete the audio file from the audio folder
 def clean_up(file_path):
     if os.path.exists(file_path):
         os.remove(file_path)
         
-#####SAI's CODE=================Start=========================================
-
-def google_search(query, site_restrict=None):
-    params = {
-        'key': GOOGLE_API_KEY,
-        'cx': GOOGLE_CSE_ID,
-        'q': query,
-        'num': 1  # Limit to 1 result
-    }
-    if site_restrict:
-        params['siteSearch'] = site_restrict
-
-    response = requests.get('https://www.googleapis.com/customsearch/v1', params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logging.error(f"Google Search API Error: {response.status_code}")
-        return {}
-
-def search_resources(subtopics):
-    # final_resources = {}
-    topic_resources = []
-    # subtopics = ["Singly Linked Lists", "Node Structure", "Head Pointer", "Traversal"]
-    for topic in subtopics:
-        
-        youtube = ""
-        google = ""
-        # 1 YouTube video
-        youtube_result = google_search(topic, site_restrict="youtube.com")
-        if youtube_result.get('items'):
-            video_item = youtube_result['items'][0]
-            youtube = video_item['link']
-         
-
-        # 1 non-YouTube resource
-        non_video_result = google_search(topic)
-        if non_video_result.get('items'):
-            for item in non_video_result['items']:
-                if "youtube.com" not in item['link']:
-                    google = item['link']
-                  
-                    break
-        topic_resources.append({
-            "topic": topic,
-            "googleLink": google,
-            "youtubeLink": youtube,
-        })
-      
-
-    return topic_resources
-
-#####SAI's CODE=================End=========================================
-
-
-def extract_cleaned_value(pattern, text):
-    match = re.search(pattern, text)
-    if match:
-        return match.group(1).replace("*", "").strip()
-    return None
-
-def extract_keywords(transcription):
-    
-    prompt = f'''
-    You are an AI assistant helping a student break down a lecture note. Based on the content below:
-
-        --- BEGIN LECTURE NOTE ---
-        {transcription}
-        --- END LECTURE NOTE ---
-
-        Please output the following sections clearly:
-
-        1. Subject: (umbrella subject that this student is studying (ex. History, Math, etc.) - only show most likely)
-        2. Class: (the class of the subject the student is studying (ex. Calculus I, Calculus II, Data Structures) - only show most likely)
-        3. Topic: Define the overarching topic (keyword)
-        4. Sub-Topics: the sub-topics covered in a lecture [in a list seperated by ,]
-        5. Summary: a concise and insightful one-sentence summary of the lecture
-
-        Example:
-        1. Subject: Computer Science
-        2. Class: Data Structure
-        3. Topic: Linked Lists
-        4. Sub-Topics: Singly Linked Lists, Node Structure, Head Pointer, Traversal
-    '''
-    model = gen_ai.GenerativeModel(model_name=os.getenv("MODEL_NAME"))
-    response = model.generate_content(prompt)
-    output_text = response.text
-    
-    subject = extract_cleaned_value(r"Subject:\s*(.+)", output_text)
-    class_name = extract_cleaned_value(r"Class:\s*(.+)", output_text)
-    topic = extract_cleaned_value(r"Topic:\s*(.+)", output_text)
-    subtopic_raw = extract_cleaned_value(r"Sub-Topics:\s*(.+)", output_text)
-    summary = extract_cleaned_value(r"Summary:\s*(.+)", output_text)
-
-
-    # Convert sub-topics into list of strings
-    subtopics = [s.strip() for s in subtopic_raw.split(",")] if subtopic_raw else []
-    
-    result_content = {
-        "subject": subject,
-        "class": class_name,
-        "topic": topic,
-        "subtopics": subtopics,
-        "summary": summary
-    }
-    return result_content
+def start_background_work(shared=False):
+    #shared=True under gunicorn, where several workers run this file (see gunicorn.conf.py)
+    background.start(shared)
 
 if __name__ == "__main__":
+    #Development server only, production runs gunicorn -c gunicorn.conf.py
     print("Connecting to MongoDB...")
     try:
         db.command("ping") # If the connection is successful, MongoDB responds with: {"ok": 1.0}
         print("✅ MongoDB connection successful!")
     except Exception as e:
         print("❌ MongoDB connection failed:", e)
-    
+
+    #With debug=True the reloader runs this file twice, only the serving child should pick up old jobs.
+    #Indexes, transcript migration, retention sweep, job resume and the search index all start here
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_work()
+
     app.run(debug=True, port=5000)
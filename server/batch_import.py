@@ -0,0 +1,308 @@
+#Batch importer for onboarding a whole course at once, without going through the HTTP API.
+#Takes folders of PDF/DOCX (and MP4/MOV) files plus text files with one YouTube URL per line,
+#and runs them through the same extraction, transcription, analysis and resource search as
+#the upload pipelines. Items run on a thread pool, PDF pages are read by the extraction
+#process pool, and finished lectures are written to Mongo with insert_many in batches.
+#Transcripts go to the compressed store as soon as they are extracted, so a lecture whose
+#analysis fails doesn't have to be transcribed again on the next run.
+#Progress goes to a checkpoint file (one JSON line per finished item), so running the same
+#command again after an interruption skips everything already imported.
+#Run from the server folder:
+#    python batch_import.py lectures/cs101 --links cs101_videos.txt
+#    python batch_import.py lectures/ --workers 8 --processes 4 --rate gemini=60 --rate google_search=100
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+IMPORT_EXTENSIONS = {'pdf', 'docx', 'mp4', 'mov'}
+DEFAULT_CHECKPOINT = "batch_import.checkpoint.jsonl"
+
+DONE = "done"
+DUPLICATE = "duplicate"
+FAILED = "failed"
+#Mongo's duplicate key error
+DUPLICATE_KEY = 11000
+
+
+class Item:
+    def __init__(self, source, kind, ext=None):
+        #source is a file path or a URL, and is what the checkpoint remembers
+        self.source = source
+        self.kind = kind
+        self.ext = ext
+
+
+def collect_items(paths, link_files):
+    items = []
+    for path in paths:
+        if os.path.isfile(path):
+            candidates = [path]
+        else:
+            candidates = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        for candidate in candidates:
+            ext = candidate.rsplit('.', 1)[-1].lower()
+            if ext in IMPORT_EXTENSIONS:
+                items.append(Item(os.path.abspath(candidate), "file", ext))
+    for link_file in link_files:
+        with open(link_file, encoding="utf-8") as f:
+            for line in f:
+                link = line.strip()
+                if link and not link.startswith("#"):
+                    items.append(Item(link, "link"))
+    #The same file or URL listed twice is only imported once
+    return list({item.source: item for item in items}.values())
+
+
+class Checkpoint:
+    #Append-only, so a crash can at worst lose the line being written
+    def __init__(self, path):
+        self.path = path
+        self.finished = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.finished[entry["source"]] = entry
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def is_done(self, source, retry_failed=True):
+        entry = self.finished.get(source)
+        return entry is not None and (entry["status"] != FAILED or not retry_failed)
+
+    def record(self, source, status, **fields):
+        entry = {"source": source, "status": status, "at": datetime.now().isoformat(), **fields}
+        with self._lock:
+            self.finished[source] = entry
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Importer:
+    def __init__(self, checkpoint, batch_size):
+        #Imported here so --processes and --rate are in place before the services load
+        from config.db import db
+        from services import analysis, extraction, fingerprints, media, resources, structure, transcripts
+        self.db = db
+        self.transcripts = transcripts
+        self.analysis = analysis
+        self.extraction = extraction
+        self.fingerprints = fingerprints
+        self.media = media
+        self.resources = resources
+        self.structure = structure
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self._transcriber = None
+        self._transcriber_lock = threading.Lock()
+        #Fingerprint keys already claimed by an item in this run
+        self._claimed = {}
+        self._claimed_lock = threading.Lock()
+        self.counts = {DONE: 0, DUPLICATE: 0, FAILED: 0}
+
+    def transcriber(self):
+        #AssemblyAI is only loaded when there's audio to transcribe
+        with self._transcriber_lock:
+            if self._transcriber is None:
+                import assemblyai as aai
+                aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
+                self._transcriber = aai.Transcriber()
+            return self._transcriber
+
+    def _check_transcript(self, transcript):
+        #TranscriptStatus is a str enum, so this works without importing assemblyai
+        if transcript.status == "error":
+            raise RuntimeError(f"Transcription failed: {transcript.error}")
+        return transcript.text
+
+    def _extract(self, item):
+        #The text in pieces: PDF pages and DOCX paragraph blocks as they're read, or one transcript
+        if item.kind == "link":
+            with self.media.workspace(f"import-{uuid.uuid4().hex}") as directory:
+                audio_path = self.media.download_audio(item.source, directory)
+                transcript = self.media.transcribe_media(self.transcriber(), audio_path)
+            return [self._check_transcript(transcript) or ""]
+        if item.ext in ('pdf', 'docx'):
+            return self.extraction.iter_text_chunks(item.source, item.ext)
+        return [self._check_transcript(self.media.transcribe_media(self.transcriber(), item.source)) or ""]
+
+    def _claim(self, key, source):
+        with self._claimed_lock:
+            owner = self._claimed.setdefault(key, source)
+        return owner == source
+
+    def process(self, item):
+        #Returns (status, fields); for new lectures fields has the document to insert
+        key = (self.fingerprints.link_key(item.source) if item.kind == "link"
+               else self.fingerprints.file_key(item.source))
+        if not self._claim(key, item.source):
+            return DUPLICATE, {"fingerprint": key}
+        entry = self.fingerprints.lookup(key) or {}
+        document_id = entry.get("documentId")
+        if document_id and self.db.Documents.count_documents({"_id": ObjectId(document_id)}, limit=1):
+            return DUPLICATE, {"fingerprint": key, "documentId": document_id}
+
+        #A transcript left by an earlier run that failed later on: finish it under the same id
+        transcript_id = entry.get("transcriptId")
+        transcript_info = self.transcripts.summary(transcript_id) if transcript_id else None
+        if transcript_info is not None:
+            document_id = ObjectId(transcript_id)
+        else:
+            document_id = ObjectId()
+            transcript_info = self.transcripts.save_stream(document_id, self._extract(item))
+            if not transcript_info["transcriptLength"]:
+                raise RuntimeError("Failed to extract text")
+            self.fingerprints.save_transcript(key, document_id)
+
+        content = entry.get("analysis") if entry.get("promptVersion") == self.analysis.PROMPT_VERSION else None
+        if content is None:
+            content = self.analysis.extract_keywords(self.transcripts.iter_text(document_id))
+            self.fingerprints.save_analysis(key, content, self.analysis.PROMPT_VERSION)
+
+        document = {
+            '_id': document_id,
+            'topicsCovered': content["subtopics"],
+            'summary': content["summary"],
+            'structuredResources': self.resources.search_resources(content["subtopics"]),
+            'subject': content["subject"],
+            'class': content["class"],
+            'topic': content["topic"],
+            'uploadDate': datetime.now(),
+            #Running servers' search indexes pick up lectures by updatedAt
+            'updatedAt': datetime.now(),
+            'importedFrom': item.source,
+            **transcript_info,
+        }
+        return DONE, {"fingerprint": key, "document": document}
+
+    def flush(self, pending):
+        #One insert_many for the documents, their transcripts are already stored. The batch is
+        #taken out of pending first so a failed flush is never retried by run()'s finally
+        if not pending:
+            return
+        batch = list(pending)
+        pending.clear()
+        errors = {}
+        try:
+            self.db.Documents.insert_many([fields["document"] for _, fields in batch], ordered=False)
+        except BulkWriteError as e:
+            errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        except Exception as e:
+            logging.error(f"Failed to insert {len(batch)} lecture(s): {e}")
+            for item, _ in batch:
+                self.checkpoint.record(item.source, FAILED, error=str(e))
+            self.counts[FAILED] += len(batch)
+            return
+
+        inserted = 0
+        for index, (item, fields) in enumerate(batch):
+            document_id = str(fields["document"]["_id"])
+            error = errors.get(index)
+            if error is not None and error.get("code") != DUPLICATE_KEY:
+                logging.error(f"Failed to insert {item.source}: {error.get('errmsg')}")
+                self.checkpoint.record(item.source, FAILED, error=error.get("errmsg"))
+                self.counts[FAILED] += 1
+                continue
+            #A duplicate _id is this lecture inserted by a run that stopped before its checkpoint
+            #line (the id is the stored transcript's), so it counts as imported
+            self.fingerprints.link_document(fields["fingerprint"], document_id)
+            self.checkpoint.record(item.source, DONE, documentId=document_id)
+            self.counts[DONE] += 1
+            inserted += error is None
+        #Running servers rebuild their sidebar tree on the next request
+        self.structure.invalidate()
+        logging.info(f"Inserted {inserted} lecture(s), {len(batch) - inserted} already there or failed")
+
+    def run(self, items, workers):
+        pending = []
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import")
+        futures = {pool.submit(self.process, item): item for item in items}
+        try:
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    status, fields = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to import {item.source}: {e}")
+                    self.checkpoint.record(item.source, FAILED, error=str(e))
+                    self.counts[FAILED] += 1
+                    continue
+                if status == DUPLICATE:
+                    logging.info(f"Skipping {item.source}, already imported")
+                    self.checkpoint.record(item.source, DUPLICATE, documentId=fields.get("documentId"))
+                    self.counts[DUPLICATE] += 1
+                    continue
+                pending.append((item, fields))
+                if len(pending) >= self.batch_size:
+                    self.flush(pending)
+        finally:
+            #On Ctrl+C drop what hasn't started, but keep the lectures that are already done
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.flush(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import folders of lecture files and lists of YouTube links")
+    parser.add_argument("paths", nargs="*", help="files or folders (searched recursively) of PDF/DOCX/MP4/MOV")
+    parser.add_argument("--links", nargs="+", default=[], metavar="FILE", help="text files with one URL per line")
+    parser.add_argument("--workers", type=int, default=4, help="lectures processed at the same time")
+    parser.add_argument("--processes", type=int, help="PDF extraction processes (EXTRACT_PROCESSES)")
+    parser.add_argument("--rate", action="append", default=[], metavar="SERVICE=PER_MINUTE",
+                        help="rate limit for gemini, google_search, assemblyai or yt_dlp; can be repeated")
+    parser.add_argument("--batch-size", type=int, default=50, help="documents per insert_many")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="progress file, reused to resume")
+    parser.add_argument("--skip-failed", action="store_true", help="don't retry items that failed last time")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.processes:
+        os.environ["EXTRACT_PROCESSES"] = str(args.processes)
+    from services import ratelimit
+    for service, per_minute in ratelimit.parse_limits(",".join(args.rate)).items():
+        ratelimit.set_limit(service, per_minute)
+
+    items = collect_items(args.paths, args.links)
+    if not items:
+        parser.error("nothing to import, give folders/files or --links")
+    checkpoint = Checkpoint(args.checkpoint)
+    todo = [item for item in items if not checkpoint.is_done(item.source, retry_failed=not args.skip_failed)]
+    logging.info(f"{len(items)} item(s) found, {len(items) - len(todo)} already done according to {args.checkpoint}")
+
+    started = time.perf_counter()
+    importer = Importer(checkpoint, args.batch_size)
+    try:
+        importer.run(todo, args.workers)
+    except KeyboardInterrupt:
+        #Everything in the checkpoint is safe, the next run picks up the rest
+        logging.warning("Interrupted, run the same command again to resume")
+        sys.exit(130)
+    finally:
+        checkpoint.close()
+        if importer.extraction._pool is not None:
+            importer.extraction._pool.shutdown()
+
+    counts = importer.counts
+    print(f"✅ Imported {counts[DONE]}, skipped {counts[DUPLICATE]} duplicate(s), "
+          f"{counts[FAILED]} failed in {time.perf_counter() - started:.0f}s")
+    if counts[FAILED]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
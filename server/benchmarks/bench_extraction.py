@@ -0,0 +1,74 @@
+#Compares the PDF extraction backends on pages/s and MB/s.
+#Run from the server folder:
+#    python -m benchmarks.bench_extraction lecture_pack.pdf other.pdf
+#    python -m benchmarks.bench_extraction --generate 400      (builds a synthetic PDF with PyMuPDF)
+#    python -m benchmarks.bench_extraction slides.pdf --processes 1 4 8
+import argparse
+import os
+import tempfile
+import time
+
+from services import extraction
+
+LOREM = ("Recursion is a method of solving a problem where the solution depends on solutions to "
+         "smaller instances of the same problem. A linked list is a linear collection of nodes. ")
+
+
+def generate_pdf(pages):
+    import fitz  # PyMuPDF
+    path = os.path.join(tempfile.gettempdir(), f"bench_{pages}_pages.pdf")
+    pdf = fitz.open()
+    for number in range(pages):
+        page = pdf.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), f"Page {number + 1}\n" + LOREM * 20, fontsize=9)
+    pdf.save(path)
+    pdf.close()
+    return path
+
+
+def run(path, backend, processes):
+    started = time.perf_counter()
+    pages = 0
+    chars = 0
+    for _, text in extraction.iter_pdf_pages(path, backend=backend, processes=processes):
+        pages += 1
+        chars += len(text)
+    return pages, chars, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF text extraction backends")
+    parser.add_argument("files", nargs="*", help="PDF files to read")
+    parser.add_argument("--generate", type=int, metavar="PAGES", help="add a synthetic PDF with this many pages")
+    parser.add_argument("--backends", nargs="+", default=list(extraction.PDF_BACKENDS), choices=list(extraction.PDF_BACKENDS))
+    parser.add_argument("--processes", nargs="+", type=int, default=[1, extraction.EXTRACT_PROCESSES])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per combination, the best one is reported")
+    args = parser.parse_args()
+
+    files = list(args.files)
+    if args.generate:
+        files.append(generate_pdf(args.generate))
+    if not files:
+        parser.error("give at least one PDF or --generate PAGES")
+
+    print(f"{'file':<28} {'backend':<11} {'procs':>5} {'pages':>6} {'MB':>7} {'sec':>8} {'pages/s':>9} {'MB/s':>7}")
+    for path in files:
+        megabytes = os.path.getsize(path) / (1024 * 1024)
+        for backend in args.backends:
+            for processes in sorted(set(args.processes)):
+                try:
+                    best = min((run(path, backend, processes) for _ in range(args.repeat)), key=lambda r: r[2])
+                except Exception as e:
+                    print(f"{os.path.basename(path)[:28]:<28} {backend:<11} {processes:>5}  failed: {e}")
+                    continue
+                pages, _, seconds = best
+                print(f"{os.path.basename(path)[:28]:<28} {backend:<11} {processes:>5} {pages:>6} {megabytes:>7.2f} "
+                      f"{seconds:>8.3f} {pages / seconds:>9.1f} {megabytes / seconds:>7.2f}")
+
+    #Let the page workers exit before the interpreter does
+    if extraction._pool is not None:
+        extraction._pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#Measures /search latency on a generated corpus: indexes N synthetic lectures (word frequencies
+#follow Zipf's law like real text), writes the snapshot the server workers map, adds a few
+#documents on top like a running server would have, then times search() for common words,
+#rare words, multi-word queries and phrases. Exits with status 1 if a p95 is over the budget.
+#Run from the server folder:
+#    python -m benchmarks.bench_search
+#    python -m benchmarks.bench_search --docs 20000 --words 3000 --budget 50
+import argparse
+import itertools
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from services import search_index
+
+VOCABULARY = 50000
+
+
+def make_corpus(docs, words, seed):
+    rng = random.Random(seed)
+    cumulative = list(itertools.accumulate(1 / rank for rank in range(1, VOCABULARY + 1)))
+    for number in range(docs):
+        tokens = [f"w{rank}" for rank in rng.choices(range(VOCABULARY), cum_weights=cumulative, k=words)]
+        yield {
+            "_id": f"{number:024x}",
+            "summary": " ".join(tokens[:60]),
+            "topicsCovered": tokens[60:65],
+            "transcript": " ".join(tokens[65:]),
+        }
+
+
+def make_queries(corpus_sample, rng, count):
+    #Phrases are taken from real documents so they match somewhere
+    def phrase():
+        tokens = search_index.tokenize(rng.choice(corpus_sample)["transcript"])
+        start = rng.randrange(len(tokens) - 2)
+        return '"' + " ".join(tokens[start:start + 2]) + '"'
+
+    return {
+        "common word": [f"w{rng.randrange(10)}" for _ in range(count)],
+        "rare word": [f"w{rng.randrange(5000, VOCABULARY)}" for _ in range(count)],
+        "three words": [" ".join(f"w{rng.randrange(2000)}" for _ in range(3)) for _ in range(count)],
+        "phrase": [phrase() for _ in range(count)],
+        "phrase + word": [f"{phrase()} w{rng.randrange(100)}" for _ in range(count)],
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(args):
+    corpus = make_corpus(args.docs + args.extra, args.words, args.seed)
+    sample = []
+
+    started = time.perf_counter()
+    for doc in itertools.islice(corpus, args.docs):
+        search_index.add_document(doc)
+        if len(sample) < 100:
+            sample.append(doc)
+        if len(search_index._doc_lengths) >= search_index.SEARCH_INDEX_BUILD_DOCS:
+            search_index.publish()
+    search_index.publish()
+    for doc in corpus:
+        search_index.add_document(doc)
+    size = os.path.getsize(search_index._base.path) / (1024 * 1024)
+    print(f"Indexed {args.docs} + {args.extra} documents of {args.words} words in "
+          f"{time.perf_counter() - started:.1f}s, snapshot {size:.1f} MB "
+          f"({'NumPy' if search_index.np is not None else 'pure Python'} scoring)")
+
+    over = []
+    for kind, queries in make_queries(sample, random.Random(args.seed), args.queries).items():
+        #Once untimed so the first query doesn't pay for faulting the snapshot in
+        search_index.search(queries[0], args.limit)
+        timings = []
+        for query in queries:
+            query_started = time.perf_counter()
+            search_index.search(query, args.limit)
+            timings.append((time.perf_counter() - query_started) * 1000)
+        p95 = percentile(timings, 0.95)
+        print(f"{kind:>14}: p50 {statistics.median(timings):.2f} ms, p95 {p95:.2f} ms, max {max(timings):.2f} ms")
+        if p95 > args.budget:
+            over.append(kind)
+    return over
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search latency on a generated corpus")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=1500, help="words per lecture")
+    parser.add_argument("--extra", type=int, default=200, help="documents added after the snapshot")
+    parser.add_argument("--queries", type=int, default=50, help="queries per kind")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("SEARCH_BUDGET_MS", "50")),
+                        help="milliseconds allowed for the p95 of each kind of query")
+    args = parser.parse_args()
+
+    search_index.SEARCH_INDEX_DIR = tempfile.mkdtemp(prefix="bench_search_")
+    try:
+        over = run(args)
+    finally:
+        shutil.rmtree(search_index.SEARCH_INDEX_DIR, ignore_errors=True)
+    if over:
+        print(f"❌ Over the {args.budget} ms search budget: {', '.join(over)}")
+        sys.exit(1)
+    print(f"✅ Within the {args.budget} ms search budget")
+
+
+if __name__ == "__main__":
+    main()
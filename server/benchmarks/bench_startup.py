@@ -0,0 +1,81 @@
+#Measures a server worker's cold start: the time to import wsgi (the whole app) in a fresh
+#interpreter, and the memory it holds afterwards. Exits with status 1 over the budget.
+#Run from the server folder:
+#    python -m benchmarks.bench_startup
+#    python -m benchmarks.bench_startup --runs 10 --budget 1.5 --importtime
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+PROBE = (
+    "import time, resource\n"
+    "started = time.perf_counter()\n"
+    "import wsgi\n"
+    "elapsed = time.perf_counter() - started\n"
+    "rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+    "print(f'{elapsed} {rss}')\n"
+)
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def run_probe():
+    result = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True)
+    seconds, rss = result.stdout.strip().splitlines()[-1].split()
+    #ru_maxrss is KB on Linux and bytes on macOS
+    megabytes = int(rss) / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return float(seconds), megabytes
+
+
+def slowest_imports(limit, module="wsgi"):
+    #Packages loaded while importing wsgi, ranked by their own import time summed over all their
+    #modules (numpy.linalg, numpy.fft, ... all count as numpy), from python -X importtime.
+    #Children are printed before the module that imports them, at a deeper indent
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    tree = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        if len(match.group(3)) == 1:
+            if match.group(4) == module:
+                break
+            #Something the interpreter loaded at startup, not part of the app
+            tree = []
+            continue
+        tree.append((match.group(4), int(match.group(1))))
+    totals = Counter()
+    for name, self_us in tree:
+        totals[name.split(".")[0]] += self_us / 1e6
+    return totals.most_common(limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure worker cold-start time and memory")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET_SECONDS", "2")),
+                        help="seconds allowed for the median import")
+    parser.add_argument("--importtime", action="store_true", help="also list the packages that take longest to import")
+    args = parser.parse_args()
+
+    results = [run_probe() for _ in range(args.runs)]
+    seconds = [r[0] for r in results]
+    median = statistics.median(seconds)
+    print(f"import wsgi: median {median:.3f}s, min {min(seconds):.3f}s, max {max(seconds):.3f}s "
+          f"over {args.runs} runs, peak RSS {max(r[1] for r in results):.1f} MB")
+    if args.importtime:
+        for package, package_seconds in slowest_imports(15):
+            print(f"    {package_seconds:>7.3f}s  {package}")
+
+    if median > args.budget:
+        print(f"❌ Over the {args.budget}s startup budget")
+        sys.exit(1)
+    print(f"✅ Within the {args.budget}s startup budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#Local stand-ins for every outside service, so the server can be load tested offline.
+#Each fake takes a Faults object: a base latency, random jitter on top of it, and the
+#fraction of calls that should fail.
+import json
+import random
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+SUBJECTS = [
+    ("Computer Science", "Data Structures", "Linked Lists", ["Singly Linked Lists", "Node Structure", "Traversal"]),
+    ("Computer Science", "Algorithms", "Recursion", ["Base Case", "Call Stack", "Big-O"]),
+    ("Math", "Calculus I", "Derivatives", ["Limits", "Chain Rule", "Product Rule"]),
+    ("History", "World History", "Industrial Revolution", ["Steam Engine", "Urbanization", "Factories"]),
+]
+
+
+class Faults:
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    def wait(self):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def should_fail(self):
+        return random.random() < self.failure_rate
+
+
+class FakeTranscriber:
+    #Stands in for aai.Transcriber: transcribe(path or stream) -> object with status/text/error
+    def __init__(self, faults=None, words=3000):
+        self.faults = faults or Faults()
+        self.words = words
+
+    def transcribe(self, data, config=None):
+        if hasattr(data, "read"):
+            #Drain the stream like the real upload would
+            while data.read(64 * 1024):
+                pass
+        self.faults.wait()
+        if self.faults.should_fail():
+            return types.SimpleNamespace(status="error", error="injected transcription failure", text=None)
+        subject = random.choice(SUBJECTS)
+        text = " ".join(random.choice(subject[3] + ["the", "lecture", "covers", "example"]) for _ in range(self.words))
+        return types.SimpleNamespace(status="completed", error=None, text=f"{subject[2]}. {text}")
+
+
+class FakeModel:
+    #Stands in for gen_ai.GenerativeModel, answers with the JSON the analysis step asks for
+    def __init__(self, faults=None):
+        self.faults = faults or Faults()
+
+    def generate_content(self, prompt, generation_config=None):
+        self.faults.wait()
+        if self.faults.should_fail():
+            raise RuntimeError("injected model failure")
+        matches = [s for s in SUBJECTS if s[2] in prompt] or SUBJECTS
+        subject, class_name, topic, subtopics = random.choice(matches)
+        answer = {
+            "subject": subject,
+            "class": class_name,
+            "topic": topic,
+            "subtopics": subtopics,
+            "summary": f"A lecture about {topic.lower()}.",
+        }
+        return types.SimpleNamespace(text=json.dumps(answer))
+
+
+def fake_download_audio(faults=None):
+    #Replacement for media.download_audio that writes a few bytes instead of calling yt-dlp
+    faults = faults or Faults()
+
+    def download_audio(video_url, directory):
+        faults.wait()
+        if faults.should_fail():
+            raise RuntimeError("injected download failure")
+        path = f"{directory}/audio.opus"
+        with open(path, "wb") as f:
+            f.write(b"OggS" + video_url.encode("utf-8"))
+        return path
+
+    return download_audio
+
+
+class StubSearchServer:
+    #A local Custom Search endpoint on 127.0.0.1; point GOOGLE_SEARCH_URL at .url
+    #Failures answer 429 with a Retry-After so the client's backoff gets exercised
+    def __init__(self, faults=None, port=0):
+        faults = faults or Faults()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                faults.wait()
+                if faults.should_fail():
+                    body = {"error": {"errors": [{"reason": "rateLimitExceeded"}]}}
+                    self._send(429, body, {"Retry-After": "0"})
+                    return
+                params = parse_qs(urlsplit(self.path).query)
+                query = params.get("q", [""])[0]
+                site = params.get("siteSearch", ["example.com"])[0]
+                link = f"https://{site}/search?q={query.replace(' ', '+')}"
+                self._send(200, {"items": [{"link": link, "title": query}]})
+
+            def _send(self, status, body, headers=None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/customsearch/v1"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
@@ -0,0 +1,230 @@
+#Load test for the API with every outside service faked (see benchmarks/fakes.py), so it runs
+#offline and doesn't spend AssemblyAI, Gemini or Custom Search quota.
+#The real Flask app, job pipelines and Mongo queries are exercised. Point it at a local mongod
+#(it uses its own database and drops it afterwards) or pass --mongomock to run without one.
+#Run from the server folder:
+#    python -m benchmarks.load_test
+#    python -m benchmarks.load_test --mongomock --scenarios transcripts content --concurrency 1 16 64
+#    python -m benchmarks.load_test --scenarios upload_link --latency 2 --jitter 1 --failure-rate 0.05
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from bson import ObjectId
+
+from benchmarks import fakes
+
+SCENARIOS = ["upload_link", "upload_file", "transcripts", "content"]
+UPLOAD_SCENARIOS = {"upload_link", "upload_file"}
+FINISHED_STATUSES = {"completed", "skipped", "failed"}
+POLL_SECONDS = 0.2
+
+DOCX_CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                      '<Default Extension="xml" ContentType="application/xml"/>'
+                      '<Override PartName="/word/document.xml" ContentType="application/'
+                      'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+
+
+def make_docx(paragraphs):
+    #Smallest .docx the extractor accepts, built in memory
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        docx.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def ms(seconds):
+    return f"{seconds * 1000:.0f}" if seconds is not None else "-"
+
+
+class Runner:
+    def __init__(self, base_url, job_timeout):
+        self.base_url = base_url
+        self.job_timeout = job_timeout
+        self.session = requests.Session()
+        self.topics = []
+
+    def wait_for_job(self, job_id):
+        deadline = time.perf_counter() + self.job_timeout
+        while time.perf_counter() < deadline:
+            job = self.session.get(f"{self.base_url}/jobs/{job_id}").json()
+            if job.get("status") in FINISHED_STATUSES:
+                return job["status"]
+            time.sleep(POLL_SECONDS)
+        return "timeout"
+
+    def upload_link(self):
+        video_id = uuid.uuid4().hex[:11]
+        return self.session.post(f"{self.base_url}/upload_link",
+                                 json={"link": f"https://www.youtube.com/watch?v={video_id}"})
+
+    def upload_file(self):
+        subject = random.choice(fakes.SUBJECTS)
+        paragraphs = [subject[2], f"Lecture {uuid.uuid4().hex}"] + [" ".join(subject[3])] * 200
+        files = {"file": ("lecture.docx", make_docx(paragraphs))}
+        return self.session.post(f"{self.base_url}/upload_file", files=files)
+
+    def transcripts(self):
+        return self.session.get(f"{self.base_url}/transcripts", params={"limit": 100})
+
+    def content(self):
+        subject, class_name, topic = random.choice(self.topics)
+        return self.session.get(f"{self.base_url}/content",
+                                params={"subject": subject, "class": class_name, "topic": topic})
+
+    def one_request(self, scenario):
+        #(request seconds, end-to-end seconds or None, ok)
+        started = time.perf_counter()
+        try:
+            response = getattr(self, scenario)()
+            response.content
+        except requests.RequestException:
+            return time.perf_counter() - started, None, False
+        elapsed = time.perf_counter() - started
+        if scenario not in UPLOAD_SCENARIOS:
+            return elapsed, None, response.ok
+        if response.status_code != 202:
+            return elapsed, None, False
+        status = self.wait_for_job(response.json()["job_id"])
+        return elapsed, time.perf_counter() - started, status in ("completed", "skipped")
+
+    def run(self, scenario, concurrency, count):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: self.one_request(scenario), range(count)))
+        wall = time.perf_counter() - started
+
+        latencies = [r[0] for r in results]
+        end_to_end = [r[1] for r in results if r[1] is not None and r[2]]
+        errors = sum(1 for r in results if not r[2])
+        row = (f"{scenario:<12} {concurrency:>5} {count:>6} {errors:>6} {ms(percentile(latencies, 50)):>8} "
+               f"{ms(percentile(latencies, 99)):>8} {count / wall:>8.1f}")
+        if scenario in UPLOAD_SCENARIOS:
+            row += (f" {ms(percentile(end_to_end, 50)):>9} {ms(percentile(end_to_end, 99)):>9}"
+                    f" {len(end_to_end) / wall * 60:>10.1f}")
+        print(row, flush=True)
+
+
+def seed_documents(db, count):
+    #Enough lectures for the read scenarios to have something to page through
+    missing = count - db.Documents.count_documents({})
+    if missing <= 0:
+        return
+    from services import transcripts
+    transcriber = fakes.FakeTranscriber(words=2000)
+    now = datetime.now()
+    batch = []
+    for number in range(missing):
+        subject, class_name, topic, subtopics = fakes.SUBJECTS[number % len(fakes.SUBJECTS)]
+        document_id = ObjectId()
+        batch.append({
+            "_id": document_id,
+            **transcripts.save(document_id, transcriber.transcribe(None).text),
+            "subject": subject,
+            "class": class_name,
+            "topic": topic,
+            "topicsCovered": subtopics,
+            "summary": f"A lecture about {topic.lower()}.",
+            "structuredResources": [],
+            "uploadDate": now - timedelta(minutes=number),
+        })
+    db.Documents.insert_many(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API against fake outside services")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and concurrency level")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds every fake outside call takes")
+    parser.add_argument("--jitter", type=float, default=0.1, help="random extra seconds on top of --latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of fake calls that fail")
+    parser.add_argument("--workers", type=int, default=4, help="JOB_WORKERS for the server")
+    parser.add_argument("--seed", type=int, default=200, help="lectures to insert before the read scenarios")
+    parser.add_argument("--job-timeout", type=float, default=600, help="seconds to wait for one upload job")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--mongo-db", default="studyez_bench")
+    parser.add_argument("--mongomock", action="store_true", help="use an in-memory mongomock client")
+    parser.add_argument("--keep-db", action="store_true", help="don't drop the benchmark database afterwards")
+    args = parser.parse_args()
+    if args.mongo_db == "vidoes":
+        sys.exit("Refusing to load test the production database")
+
+    faults = fakes.Faults(args.latency, args.jitter, args.failure_rate)
+    search_server = fakes.StubSearchServer(faults).start()
+
+    #All of this has to be in place before the app and its services are imported
+    os.environ["MONGO_URI"] = args.mongo_uri
+    os.environ["MONGO_DB_NAME"] = args.mongo_db
+    os.environ["GOOGLE_SEARCH_URL"] = search_server.url
+    os.environ["JOB_WORKERS"] = str(args.workers)
+    os.environ.setdefault("JOB_QUEUE_LIMIT", "100000")
+    os.environ["MEDIA_WORKSPACE_ROOT"] = tempfile.mkdtemp(prefix="studyez_bench_audio_")
+    if args.mongomock:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+
+    import app as server
+    from config.db import client, db
+    from config.indexes import ensure_indexes
+    from services import analysis, media, structure
+    from werkzeug.serving import make_server
+
+    if not args.mongomock:
+        ensure_indexes()
+    server.transcriber = fakes.FakeTranscriber(faults)
+    analysis.set_model(fakes.FakeModel(faults))
+    media.download_audio = fakes.fake_download_audio(faults)
+
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    runner = Runner(f"http://127.0.0.1:{httpd.server_port}", args.job_timeout)
+
+    print(f"fake latency {args.latency}s +{args.jitter}s, failure rate {args.failure_rate}, "
+          f"{args.workers} job workers, database {args.mongo_db}{' (mongomock)' if args.mongomock else ''}")
+    print(f"{'scenario':<12} {'conc':>5} {'reqs':>6} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}"
+          f" {'e2e p50':>9} {'e2e p99':>9} {'uploads/min':>10}")
+    try:
+        for scenario in args.scenarios:
+            if scenario not in UPLOAD_SCENARIOS:
+                seed_documents(db, args.seed)
+                runner.topics = [(subject, class_name, topic)
+                                 for subject, classes in structure.build_structure().items()
+                                 for class_name, topics in classes.items()
+                                 for topic in topics]
+            for concurrency in args.concurrency:
+                runner.run(scenario, concurrency, args.requests)
+    finally:
+        httpd.shutdown()
+        search_server.stop()
+        if not args.keep_db:
+            client.drop_database(args.mongo_db)
+
+
+if __name__ == "__main__":
+    main()
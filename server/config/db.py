@@ -5,5 +5,13 @@ import os
 
 load_dotenv()
 uri = os.getenv('MONGO_URI')
-client = MongoClient(uri)
-db = client["vidoes"]
+#One pooled client per process. connect=False waits for the first query to open connections,
+#so importing this stays fast and nothing is shared across the fork of server workers
+client = MongoClient(
+    uri,
+    connect=False,
+    maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', '50')),
+    serverSelectionTimeoutMS=int(os.getenv('MONGO_TIMEOUT_MS', '10000')),
+)
+#Benchmarks and other tooling point this at a scratch database
+db = client[os.getenv('MONGO_DB_NAME', 'vidoes')]
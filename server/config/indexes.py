@@ -0,0 +1,147 @@
+#Index bootstrap for the Documents, Jobs, AnalysisCache, SearchDeletions and Fingerprints collections,
+#run once when the server starts.
+#Also has a small explain() check that makes sure every query shape the app sends is
+#served by an index instead of a collection scan:
+#    python -m config.indexes            -> create indexes and check the query plans
+#    MONGO_URI=mongodb://localhost:27017 python -m config.indexes
+#Exits with status 1 if any query falls back to COLLSCAN. tests/test_query_plans.py runs the
+#same check against a scratch database when a mongod is reachable.
+import logging
+import os
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+from config.db import db
+
+DOCUMENT_INDEXES = [
+    #/content filters on subject/class/topic and the sidebar sorts by upload date
+    {"keys": [("subject", ASCENDING), ("class", ASCENDING), ("topic", ASCENDING), ("uploadDate", DESCENDING)],
+     "name": "subject_class_topic_uploadDate"},
+    #In-app search over the lecture text (transcripts live compressed in Transcripts now)
+    {"keys": [("summary", TEXT), ("topicsCovered", TEXT)],
+     "name": "summary_topics_text"},
+    #Every process's search index sync asks for documents stored or re-analyzed since its last look
+    {"keys": [("updatedAt", ASCENDING)], "name": "updatedAt"},
+]
+#Replaced above; a collection can only have one text index so the old one has to go first
+OBSOLETE_INDEXES = ["transcript_summary_text"]
+
+#Finished (completed or failed) jobs are kept this long for /jobs and retries, then Mongo drops them
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_INDEXES = [
+    #/jobs?status=... and the resume check for queued/running jobs
+    {"keys": [("status", ASCENDING), ("createdAt", DESCENDING)], "name": "status_createdAt"},
+    #/jobs without a status filter
+    {"keys": [("createdAt", DESCENDING)], "name": "createdAt"},
+    #TTL: only finished jobs have finishedAt, so pending ones never expire
+    {"keys": [("finishedAt", ASCENDING)], "name": "finishedAt_ttl",
+     "expireAfterSeconds": int(JOB_RETENTION_DAYS * 86400)},
+]
+
+#Cached model answers are dropped after this long, so the cache doesn't grow forever
+ANALYSIS_CACHE_DAYS = float(os.getenv("ANALYSIS_CACHE_DAYS", "30"))
+ANALYSIS_CACHE_INDEXES = [
+    {"keys": [("createdAt", ASCENDING)], "name": "createdAt_ttl",
+     "expireAfterSeconds": int(ANALYSIS_CACHE_DAYS * 86400)},
+]
+
+#Tombstones of deleted lectures for the search index sync; the writer folds them into a new
+#snapshot within minutes, a week covers it being down for a while
+SEARCH_DELETION_DAYS = float(os.getenv("SEARCH_DELETION_DAYS", "7"))
+SEARCH_DELETION_INDEXES = [
+    {"keys": [("deletedAt", ASCENDING)], "name": "deletedAt_ttl",
+     "expireAfterSeconds": int(SEARCH_DELETION_DAYS * 86400)},
+]
+
+FINGERPRINT_INDEXES = [
+    #Deleting lectures unlinks their fingerprints (fingerprints.unlink_documents)
+    {"keys": [("documentId", ASCENDING)], "name": "documentId"},
+]
+
+#Every filter/sort the app sends to Documents (and the other collections), checked by check_query_plans
+QUERY_SHAPES = {
+    "content": {"filter": {"subject": "s", "class": "c", "topic": "t"}, "sort": [("uploadDate", DESCENDING)]},
+    "topic_delete": {"filter": {"subject": "s", "class": "c", "topic": "t"}},
+    "class_delete": {"filter": {"subject": "s", "class": "c"}},
+    "subject_delete": {"filter": {"subject": "s"}},
+    "text_search": {"filter": {"$text": {"$search": "recursion"}}},
+    "jobs_by_status": {"collection": "Jobs", "filter": {"status": "failed"}, "sort": [("createdAt", DESCENDING)]},
+    "jobs_pending": {"collection": "Jobs", "filter": {"status": {"$in": ["queued", "running"]}}},
+    "jobs_latest": {"collection": "Jobs", "filter": {}, "sort": [("createdAt", DESCENDING)]},
+    "search_sync": {"filter": {"updatedAt": {"$gte": datetime(2024, 1, 1)}}},
+    "fingerprints_unlink": {"collection": "Fingerprints", "filter": {"documentId": {"$in": ["d"]}}},
+    "search_deletions": {"collection": "SearchDeletions", "filter": {"deletedAt": {"$gte": datetime(2024, 1, 1)}}},
+}
+
+
+def ensure_indexes(database=db):
+    #create_index is a no-op when the index already exists, so this is safe on every start
+    existing = database.Documents.index_information()
+    for name in OBSOLETE_INDEXES:
+        if name in existing:
+            database.Documents.drop_index(name)
+            logging.info(f"Dropped obsolete index {name} on Documents")
+    for spec in DOCUMENT_INDEXES:
+        database.Documents.create_index(spec["keys"], name=spec["name"])
+    logging.info(f"Ensured {len(DOCUMENT_INDEXES)} index(es) on Documents")
+
+    _ensure_collection_indexes(database, "Jobs", JOB_INDEXES)
+    _ensure_collection_indexes(database, "AnalysisCache", ANALYSIS_CACHE_INDEXES)
+    _ensure_collection_indexes(database, "SearchDeletions", SEARCH_DELETION_INDEXES)
+    _ensure_collection_indexes(database, "Fingerprints", FINGERPRINT_INDEXES)
+
+
+def _ensure_collection_indexes(database, collection, specs):
+    existing = database[collection].index_information()
+    for spec in specs:
+        ttl = spec.get("expireAfterSeconds")
+        current = existing.get(spec["name"])
+        if ttl is not None and current is not None and current.get("expireAfterSeconds") != ttl:
+            #create_index refuses to change options, collMod updates the TTL in place
+            database.command("collMod", collection, index={"name": spec["name"], "expireAfterSeconds": ttl})
+            continue
+        options = {"expireAfterSeconds": ttl} if ttl is not None else {}
+        database[collection].create_index(spec["keys"], name=spec["name"], **options)
+    logging.info(f"Ensured {len(specs)} index(es) on {collection}")
+
+
+def _stages(plan):
+    #Walk the winning plan tree and collect every stage name
+    stages = [plan.get("stage")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages += _stages(plan[child_key])
+    for child in plan.get("inputStages", []):
+        stages += _stages(child)
+    return stages
+
+
+def explain_stages(shape, database=db):
+    cursor = database[shape.get("collection", "Documents")].find(shape["filter"])
+    if shape.get("sort"):
+        cursor = cursor.sort(shape["sort"])
+    plan = cursor.explain()["queryPlanner"]["winningPlan"]
+    return _stages(plan)
+
+
+def check_query_plans(database=db):
+    #Returns {shape name: stages} for every query shape that scans the whole collection
+    failures = {}
+    for name, shape in QUERY_SHAPES.items():
+        stages = explain_stages(shape, database)
+        if "COLLSCAN" in stages:
+            failures[name] = stages
+    return failures
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ensure_indexes()
+    failures = check_query_plans()
+    for name, stages in failures.items():
+        print(f"❌ {name} falls back to a collection scan: {' -> '.join(stages)}")
+    if failures:
+        sys.exit(1)
+    print(f"✅ All {len(QUERY_SHAPES)} query shapes use an index")
@@ -0,0 +1,41 @@
+#gunicorn settings for production, run from the server folder:
+#    gunicorn -c gunicorn.conf.py
+#Everything can be overridden with the usual gunicorn flags or the env vars below.
+import os
+
+wsgi_app = "wsgi:app"
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, (os.cpu_count() or 1) * 2))))
+#Requests mostly wait on Mongo, so a few threads per worker go further than more processes
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+#Upload chunks and big /transcripts pages can be slow on a bad connection
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+#No preload: each worker imports the app after the fork, so the Mongo client, HTTP session,
+#Gemini client and thread pools are created once per worker and never shared across a fork
+preload_app = False
+#No max_requests either, upload pipelines run inside the worker and recycling it would cut
+#them off (they'd be resumed by another worker, but from the last finished stage)
+accesslog = "-"
+#Workers write their metrics here so /metrics on any worker reports all of them
+os.environ.setdefault("METRICS_DIR", "metrics")
+
+
+def on_starting(server):
+    from services import metrics
+    metrics.clear()
+
+
+def post_worker_init(worker):
+    #The app is loaded by now; one worker takes the lock and runs the background work
+    from app import start_background_work
+    from services import metrics
+    metrics.start_flushing()
+    start_background_work(shared=True)
+
+
+def child_exit(server, worker):
+    from services import metrics
+    metrics.mark_process_dead(worker.pid)
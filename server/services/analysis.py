@@ -0,0 +1,362 @@
+#Lecture analysis with Gemini: subject, class, topic, sub-topics and a summary.
+#Short texts go to the model in one prompt like before. Long transcripts are split on
+#paragraph/sentence boundaries into chunks that fit the context window; the chunks are
+#analyzed in parallel (map) and the partial answers are merged by one more call (reduce).
+#The text can also come in pieces (pages of a PDF or of a stored transcript), which are cut
+#into chunks as they arrive instead of being joined first.
+#The model is asked for JSON, which is checked against ANALYSIS_SCHEMA. A malformed answer
+#is sent back to the model for repair (without the transcript) instead of redoing the call.
+#Every validated answer is cached in the AnalysisCache collection under the hash of its input,
+#PROMPT_VERSION and MODEL_NAME, so re-analyzing an edited transcript only pays for the changed
+#chunks. fresh=True (reanalyze) skips the lookup; entries expire after ANALYSIS_CACHE_DAYS.
+#Subject/class/topic names are matched against the ones already stored, so "Data Structure"
+#and "Data Structures" end up in the same sidebar folder.
+#The Gemini client is created once per process, on the first analysis, so importing this
+#module (and starting a server worker) doesn't pay for the google SDK.
+#set_model() swaps Gemini for any object with generate_content(prompt, generation_config) -> .text,
+#e.g. a local fake for offline testing.
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+from dotenv import load_dotenv
+
+from config.db import db
+from services import metrics
+
+load_dotenv()
+
+#Bump this whenever a prompt below changes so cached analyses get redone
+PROMPT_VERSION = 2
+#Part of the cache key too, switching models redoes the analyses
+MODEL_NAME = os.getenv("MODEL_NAME")
+
+#Rough budget for one chunk, well under the model's context window
+CHUNK_TOKENS = int(os.getenv("ANALYSIS_CHUNK_TOKENS", "8000"))
+#Chunks sent to the model at the same time (across all uploads)
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "4"))
+#Most sub-topics kept after merging the chunks
+MAX_SUBTOPICS = 12
+#English text averages about 4 characters per token
+CHARS_PER_TOKEN = 4
+#Repair attempts for an answer that isn't valid JSON / doesn't match the schema
+PARSE_RETRIES = 2
+
+#field -> (type, required non-empty)
+ANALYSIS_SCHEMA = {
+    "subject": (str, True),
+    "class": (str, True),
+    "topic": (str, True),
+    "subtopics": (list, True),
+    "summary": (str, True),
+}
+GENERATION_CONFIG = {"response_mime_type": "application/json"}
+ROMAN_NUMERALS = {"i": "1", "ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6", "vii": "7", "viii": "8", "ix": "9", "x": "10"}
+
+_executor = ThreadPoolExecutor(max_workers=ANALYSIS_CONCURRENCY, thread_name_prefix="analysis")
+_model = None
+_model_lock = Lock()
+
+SECTIONS_PROMPT = '''
+        Respond with only a JSON object with exactly these keys:
+
+        "subject": umbrella subject that this student is studying (ex. History, Math, etc.) - only the most likely
+        "class": the class of the subject the student is studying (ex. Calculus I, Calculus II, Data Structures) - only the most likely
+        "topic": the overarching topic (keyword)
+        "subtopics": list of the sub-topics covered in the lecture
+        "summary": a concise and insightful one-sentence summary of the lecture
+
+        Example:
+        {"subject": "Computer Science", "class": "Data Structures", "topic": "Linked Lists",
+         "subtopics": ["Singly Linked Lists", "Node Structure", "Head Pointer", "Traversal"],
+         "summary": "Introduces singly linked lists and how to traverse them from the head pointer."}
+'''
+
+
+class AnalysisFormatError(ValueError):
+    pass
+
+
+def set_model(model):
+    #None goes back to Gemini
+    global _model
+    with _model_lock:
+        _model = model
+
+
+def get_model():
+    global _model
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is None:
+            import google.generativeai as gen_ai
+            gen_ai.configure(api_key=os.getenv("GEN_AI"))
+            _model = gen_ai.GenerativeModel(model_name=MODEL_NAME)
+        return _model
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _split_long(piece, max_chars):
+    #A paragraph that is too big on its own: split on sentences, then on whitespace
+    sentences = re.split(r"(?<=[.!?])\s+", piece)
+    for sentence in sentences:
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            yield sentence[:cut]
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            yield sentence
+
+
+def _iter_paragraphs(pieces):
+    #Non-blank lines of text arriving in pieces; a line cut between two pieces is put back together
+    tail = ""
+    for piece in pieces:
+        lines = (tail + piece).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if tail.strip():
+        yield tail
+
+
+def iter_chunks(pieces, max_tokens=CHUNK_TOKENS):
+    #Yields the chunks of a text that arrives in pieces, holding only the chunk being filled
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    pieces = iter(pieces)
+    head = []
+    size = 0
+    for piece in pieces:
+        head.append(piece)
+        size += len(piece)
+        if size > max_chars:
+            break
+    else:
+        #Fits in one prompt, sent exactly as it is
+        yield "".join(head)
+        return
+
+    current = []
+    size = 0
+    for paragraph in _iter_paragraphs(itertools.chain(head, pieces)):
+        parts = [paragraph] if len(paragraph) <= max_chars else _split_long(paragraph, max_chars)
+        for part in parts:
+            if size + len(part) + 1 > max_chars and current:
+                yield "\n".join(current)
+                current = []
+                size = 0
+            current.append(part)
+            size += len(part) + 1
+    if current:
+        yield "\n".join(current)
+
+
+def split_text(text, max_tokens=CHUNK_TOKENS):
+    return list(iter_chunks([text], max_tokens))
+
+
+def validate_analysis(data):
+    if not isinstance(data, dict):
+        raise AnalysisFormatError("answer is not a JSON object")
+    for field, (kind, required) in ANALYSIS_SCHEMA.items():
+        value = data.get(field)
+        if not isinstance(value, kind):
+            raise AnalysisFormatError(f"'{field}' should be a {kind.__name__}")
+        if required and not value:
+            raise AnalysisFormatError(f"'{field}' is empty")
+    if not all(isinstance(item, str) for item in data["subtopics"]):
+        raise AnalysisFormatError("'subtopics' should only contain strings")
+
+    return {
+        "subject": data["subject"].strip(),
+        "class": data["class"].strip(),
+        "topic": data["topic"].strip(),
+        "subtopics": [item.strip() for item in data["subtopics"] if item.strip()],
+        "summary": data["summary"].strip(),
+    }
+
+
+def parse_analysis(output_text):
+    #Models sometimes wrap JSON in ```json fences even when asked not to
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", output_text.strip())
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise AnalysisFormatError(f"invalid JSON: {e}") from e
+    return validate_analysis(data)
+
+
+def _generate(prompt):
+    with metrics.external_call("gemini"):
+        return get_model().generate_content(prompt, generation_config=GENERATION_CONFIG).text
+
+
+def _repair(output_text, error):
+    #Only the broken answer goes back to the model, not the (possibly huge) lecture text
+    prompt = f'''
+    The JSON below was supposed to describe a lecture but it is invalid ({error}).
+    Fix it and respond with only the corrected JSON object.
+
+        --- BEGIN JSON ---
+        {output_text}
+        --- END JSON ---
+{SECTIONS_PROMPT}'''
+    return _generate(prompt)
+
+
+def generate_analysis(prompt):
+    output_text = _generate(prompt)
+    for attempt in range(PARSE_RETRIES + 1):
+        try:
+            return parse_analysis(output_text)
+        except AnalysisFormatError as e:
+            if attempt == PARSE_RETRIES:
+                raise AnalysisFormatError(f"Model answer still invalid after {PARSE_RETRIES} repairs: {e}") from e
+            logging.warning(f"Model answer invalid ({e}), asking for a repair")
+            output_text = _repair(output_text, e)
+
+
+def _cache_key(kind, text):
+    return hashlib.sha256(f"{PROMPT_VERSION}|{MODEL_NAME}|{kind}|{text}".encode("utf-8")).hexdigest()
+
+
+def _ask(kind, text, prompt, fresh=False):
+    #One cached model call; kind keeps whole/chunk/reduce prompts for the same text apart.
+    #fresh=True always asks the model, and the new answer replaces the cached one
+    key = _cache_key(kind, text)
+    if not fresh:
+        cached = db.AnalysisCache.find_one({"_id": key})
+        if cached is not None:
+            return cached["result"]
+
+    result = generate_analysis(prompt)
+    db.AnalysisCache.update_one(
+        {"_id": key},
+        {"$set": {"result": result, "promptVersion": PROMPT_VERSION, "modelName": MODEL_NAME,
+                  "createdAt": datetime.now()}},
+        upsert=True,
+    )
+    return result
+
+
+def analyze_whole(transcription, fresh=False):
+    prompt = f'''
+    You are an AI assistant helping a student break down a lecture note. Based on the content below:
+
+        --- BEGIN LECTURE NOTE ---
+        {transcription}
+        --- END LECTURE NOTE ---
+{SECTIONS_PROMPT}'''
+    return _ask("whole", transcription, prompt, fresh)
+
+
+def analyze_chunk(chunk, index, total=None, fresh=False):
+    #total is None while the transcript is still being read
+    part = f"part {index + 1} of {total}" if total else f"part {index + 1}"
+    prompt = f'''
+    You are an AI assistant helping a student break down a long lecture note.
+    This is {part} of the lecture. Based on this part only:
+
+        --- BEGIN LECTURE PART ---
+        {chunk}
+        --- END LECTURE PART ---
+{SECTIONS_PROMPT}'''
+    #The position is only context for the model, the cache key is the chunk text itself
+    return _ask("chunk", chunk, prompt, fresh)
+
+
+def _most_common(values):
+    values = [value for value in values if value]
+    return Counter(values).most_common(1)[0][0] if values else None
+
+
+def merge_locally(partials):
+    #Majority vote for the labels and the most frequent sub-topics, used if the reduce call fails
+    counts = Counter(sub for partial in partials for sub in partial["subtopics"])
+    return {
+        "subject": _most_common(p["subject"] for p in partials),
+        "class": _most_common(p["class"] for p in partials),
+        "topic": _most_common(p["topic"] for p in partials),
+        "subtopics": [sub for sub, _ in counts.most_common(MAX_SUBTOPICS)],
+        "summary": " ".join(p["summary"] for p in partials[:2] if p["summary"]) or None,
+    }
+
+
+def reduce_partials(partials, fresh=False):
+    notes = json.dumps(partials, indent=1)
+    prompt = f'''
+    You are an AI assistant helping a student break down a long lecture. The lecture was split
+    into parts and each part was analyzed separately. Combine these analyses into one for the
+    whole lecture (at most {MAX_SUBTOPICS} sub-topics, most important first):
+
+        --- BEGIN PART ANALYSES ---
+        {notes}
+        --- END PART ANALYSES ---
+{SECTIONS_PROMPT}'''
+    try:
+        merged = _ask("reduce", notes, prompt, fresh)
+    except Exception as e:
+        logging.warning(f"Reduce call failed, merging chunk analyses locally: {e}")
+        return merge_locally(partials)
+    #Fill any label the model dropped from the chunk votes
+    fallback = merge_locally(partials)
+    return {key: merged.get(key) or fallback[key] for key in fallback}
+
+
+def name_key(name):
+    #"Data Structures", "data-structure" and "Data  Structure" share a key, so do "Calculus II" and "Calculus 2"
+    words = re.findall(r"[a-z0-9]+", name.lower())
+    words = [ROMAN_NUMERALS.get(word, word) for word in words]
+    words = [word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word for word in words]
+    return " ".join(words)
+
+
+def canonical_name(name, existing):
+    #Reuse the spelling already in the database when it only differs in case, plurals or punctuation
+    key = name_key(name)
+    for candidate in existing:
+        if candidate and name_key(candidate) == key:
+            return candidate
+    return name
+
+
+def canonicalize(result):
+    subject = canonical_name(result["subject"], db.Documents.distinct("subject"))
+    class_name = canonical_name(result["class"], db.Documents.distinct("class", {"subject": subject}))
+    topic = canonical_name(result["topic"], db.Documents.distinct("topic", {"subject": subject, "class": class_name}))
+    return {**result, "subject": subject, "class": class_name, "topic": topic}
+
+
+def extract_keywords(transcription, fresh=False):
+    #transcription is the text, or an iterable of pieces of it (see iter_chunks)
+    pieces = [transcription] if isinstance(transcription, str) else transcription
+    chunks = iter_chunks(pieces)
+    first = next(chunks, "")
+    second = next(chunks, None)
+    if second is None:
+        return canonicalize(analyze_whole(first, fresh))
+
+    #Map step: the next chunk is only read once a model call frees up, so no more than
+    #2 * ANALYSIS_CONCURRENCY chunks of the transcript are in memory at a time
+    futures = deque()
+    partials = []
+    for index, chunk in enumerate(itertools.chain([first, second], chunks)):
+        if len(futures) >= 2 * ANALYSIS_CONCURRENCY:
+            partials.append(futures.popleft().result())
+        futures.append(_executor.submit(analyze_chunk, chunk, index, None, fresh))
+    partials += [future.result() for future in futures]
+    logging.info(f"Analyzed transcript in {len(partials)} chunks")
+    return canonicalize(reduce_partials(partials, fresh))
@@ -0,0 +1,84 @@
+#Work that only one process of the server should do: creating indexes, moving old inline
+#transcripts (on documents and fingerprints) to the compressed store, the retention sweep,
+#resuming jobs whose process is gone, and writing the search index snapshot every worker
+#maps (see services.search_index). The dev server is a single process and simply does it.
+#Under gunicorn every worker calls start(shared=True); the one holding the lock file does
+#the work and the others keep trying, so another worker takes over if that one dies.
+import logging
+import os
+import threading
+import time
+
+from config.indexes import ensure_indexes
+from services import fingerprints, jobs, retention, search_index, transcripts
+
+BACKGROUND_LOCK_PATH = os.getenv("BACKGROUND_LOCK_PATH", "background.lock")
+#How often the lead process looks for jobs left behind by a worker that died
+RESUME_INTERVAL_SECONDS = int(os.getenv("RESUME_INTERVAL_SECONDS", "60"))
+
+_lock_file = None
+_lead = False
+_thread = None
+
+
+def is_lead():
+    return _lead
+
+
+def _try_lock():
+    global _lock_file
+    import fcntl
+    lock_file = open(BACKGROUND_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    #Kept open for the life of the process, the OS drops the lock when it exits
+    _lock_file = lock_file
+    return True
+
+
+def _run_once(name, fn):
+    try:
+        fn()
+    except Exception as e:
+        logging.error(f"Background {name} failed: {e}")
+
+
+def _lead_startup():
+    _run_once("index setup", ensure_indexes)
+    _run_once("transcript migration", transcripts.migrate)
+    _run_once("fingerprint migration", fingerprints.migrate)
+    #After the migrations, the index reads transcripts from the store
+    search_index.set_writer()
+    #Periodically clear leftovers in uploads/ and audio/
+    retention.start()
+
+
+def _loop(shared):
+    global _lead
+    if not shared:
+        #Nothing to compete with, no lock file needed (so this works on Windows too)
+        _lead = True
+        _lead_startup()
+    while True:
+        if not _lead and _try_lock():
+            _lead = True
+            logging.info(f"Process {os.getpid()} took over the background work")
+            _lead_startup()
+        if _lead:
+            _run_once("job resume", jobs.resume_jobs)
+            _run_once("search index publish", search_index.publish_if_changed)
+        time.sleep(RESUME_INTERVAL_SECONDS)
+
+
+def start(shared=False):
+    global _thread
+    if _thread is not None:
+        return
+    _thread = threading.Thread(target=_loop, args=(shared,), name="background", daemon=True)
+    _thread.start()
+    #Open (or, in the lead, build) the search index and keep it in sync in the background, so
+    #searches never wait for it
+    threading.Thread(target=search_index.keep_in_sync, name="search-index", daemon=True).start()
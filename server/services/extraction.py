@@ -0,0 +1,164 @@
+#Text extraction for uploaded documents.
+#PDFs are read with PyMuPDF and fall back to pdfplumber when PyMuPDF is missing or chokes
+#on a file. Big PDFs are split into page ranges that run in a process pool. DOCX files are
+#streamed paragraph by paragraph straight out of the zip instead of loading the whole
+#document. Everything is a generator, so callers can start on the first pages while the
+#rest are still being read.
+#This module must stay free of app/db imports: the process pool workers import it.
+import logging
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from xml.etree.ElementTree import iterparse
+
+#Worker processes for page-level parallelism (1 = read pages in the calling thread)
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+#Pages handed to one worker at a time
+PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "16"))
+#Smaller PDFs aren't worth the process pool overhead
+PARALLEL_MIN_PAGES = int(os.getenv("EXTRACT_PARALLEL_MIN_PAGES", "64"))
+DOCX_PARAGRAPHS_PER_CHUNK = 200
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_pool = None
+_pool_lock = Lock()
+
+
+def _pymupdf_page_count(path):
+    import fitz  # PyMuPDF
+    with fitz.open(path) as pdf:
+        return pdf.page_count
+
+
+def _pymupdf_pages(path, start, end):
+    import fitz  # PyMuPDF
+    with fitz.open(path) as pdf:
+        return [pdf[number].get_text() or "" for number in range(start, end)]
+
+
+def _pdfplumber_page_count(path):
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def _pdfplumber_pages(path, start, end):
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        #extract_text() returns None for pages without a text layer
+        return [pdf.pages[number].extract_text() or "" for number in range(start, end)]
+
+
+#Backend name -> (page count function, page range function), tried in this order
+PDF_BACKENDS = {
+    "pymupdf": (_pymupdf_page_count, _pymupdf_pages),
+    "pdfplumber": (_pdfplumber_page_count, _pdfplumber_pages),
+}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            #spawn keeps the workers clear of the server's threads and open sockets
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _pick_backend(path, backend=None):
+    names = [backend] if backend else list(PDF_BACKENDS)
+    last_error = None
+    for name in names:
+        try:
+            return name, PDF_BACKENDS[name][0](path)
+        except Exception as e:
+            logging.warning(f"PDF backend {name} can't open {path}: {e}")
+            last_error = e
+    raise RuntimeError(f"No PDF backend could read {path}: {last_error}")
+
+
+def _read_range(name, path, start, end, fallback=True):
+    #Runs in a pool worker; if the chosen backend fails on these pages, try the others
+    try:
+        return PDF_BACKENDS[name][1](path, start, end)
+    except Exception as e:
+        others = [other for other in PDF_BACKENDS if other != name] if fallback else []
+        for other in others:
+            try:
+                logging.warning(f"PDF backend {name} failed on pages {start}-{end}, falling back to {other}: {e}")
+                return PDF_BACKENDS[other][1](path, start, end)
+            except Exception:
+                continue
+        raise
+
+
+def iter_pdf_pages(path, backend=None, processes=None):
+    #Yields (page number, text) in page order
+    #Passing a backend name pins it (no fallback), which is what the benchmarks need
+    name, total = _pick_backend(path, backend)
+    fallback = backend is None
+    processes = EXTRACT_PROCESSES if processes is None else processes
+    ranges = [(start, min(start + PAGES_PER_TASK, total)) for start in range(0, total, PAGES_PER_TASK)]
+
+    if processes > 1 and total >= PARALLEL_MIN_PAGES:
+        pool = _get_pool() if processes == EXTRACT_PROCESSES else ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        futures = [pool.submit(_read_range, name, path, start, end, fallback) for start, end in ranges]
+        try:
+            for (start, _), future in zip(ranges, futures):
+                for offset, text in enumerate(future.result()):
+                    yield start + offset, text
+        finally:
+            for future in futures:
+                future.cancel()
+            if pool is not _pool:
+                pool.shutdown(wait=False)
+        return
+
+    for start, end in ranges:
+        for offset, text in enumerate(_read_range(name, path, start, end, fallback)):
+            yield start + offset, text
+
+
+def iter_docx_paragraphs(path):
+    #Parse word/document.xml as a stream and throw each paragraph away once it's read
+    try:
+        with zipfile.ZipFile(path) as archive, archive.open("word/document.xml") as xml:
+            for _, element in iterparse(xml, events=("end",)):
+                if element.tag == WORD_NS + "p":
+                    yield "".join(node.text or "" for node in element.iter(WORD_NS + "t"))
+                    element.clear()
+    except (zipfile.BadZipFile, KeyError) as e:
+        logging.warning(f"Streaming DOCX read failed for {path}, using python-docx: {e}")
+        import docx
+        for para in docx.Document(path).paragraphs:
+            yield para.text
+
+
+def iter_text_chunks(path, ext):
+    #Yields pieces of text (a page for PDFs, a block of paragraphs for DOCX)
+    if ext == "pdf":
+        for _, text in iter_pdf_pages(path):
+            yield text + "\n"
+    elif ext == "docx":
+        block = []
+        for paragraph in iter_docx_paragraphs(path):
+            block.append(paragraph)
+            if len(block) >= DOCX_PARAGRAPHS_PER_CHUNK:
+                yield "\n".join(block) + "\n"
+                block = []
+        if block:
+            yield "\n".join(block)
+    else:
+        raise ValueError(f"Can't extract text from .{ext} files")
+
+
+def extract_pdf(path):
+    return "".join(iter_text_chunks(path, "pdf"))
+
+
+def extract_docx(path):
+    return "".join(iter_text_chunks(path, "docx"))
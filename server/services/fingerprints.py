@@ -0,0 +1,132 @@
+#Fingerprint index for uploads.
+#A YouTube link is identified by its canonical URL, an uploaded file by the SHA-256 of its
+#bytes. The Fingerprints collection maps that key to the document we already made from it
+#and to the intermediate results (transcript, analysis), so a repeated upload can skip
+#the download, transcription, Gemini and search work.
+#The transcript itself only lives in the Transcripts store; a fingerprint keeps its id
+#(the id of the document it was extracted for) in transcriptId.
+import hashlib
+import logging
+import re
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from config.db import db
+from services import transcripts
+
+#Read uploads in 1MB pieces so big videos never sit in memory
+HASH_CHUNK_SIZE = 1024 * 1024
+
+YOUTUBE_HOSTS = {"youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com"}
+YOUTUBE_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+#Query parameters that don't change what the link points to
+TRACKING_PARAMS = {"si", "feature", "fbclid", "gclid", "ref", "t", "start"}
+
+
+def _youtube_id(parts):
+    host = parts.netloc.lower().split(":")[0]
+    if host.startswith("www."):
+        host = host[4:]
+    path = [p for p in parts.path.split("/") if p]
+
+    if host == "youtu.be" and path:
+        video_id = path[0]
+    elif host in YOUTUBE_HOSTS:
+        if path[:1] == ["watch"]:
+            video_id = dict(parse_qsl(parts.query)).get("v", "")
+        elif len(path) >= 2 and path[0] in ("shorts", "embed", "live", "v"):
+            video_id = path[1]
+        else:
+            return None
+    else:
+        return None
+    return video_id if YOUTUBE_ID.match(video_id) else None
+
+
+def canonicalize_url(url):
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+
+    #Every way of writing a YouTube link collapses to the video id
+    video_id = _youtube_id(parts)
+    if video_id:
+        return f"youtube:{video_id}"
+
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query)
+        if key not in TRACKING_PARAMS and not key.startswith("utm_")
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_key(url):
+    return "url:" + canonicalize_url(url)
+
+
+def file_key(path):
+    return "sha256:" + file_sha256(path)
+
+
+def lookup(key):
+    return db.Fingerprints.find_one({"_id": key})
+
+
+def _save(key, fields):
+    now = datetime.now()
+    fields["updatedAt"] = now
+    db.Fingerprints.update_one(
+        {"_id": key},
+        {"$set": fields, "$setOnInsert": {"createdAt": now}},
+        upsert=True,
+    )
+
+
+def save_transcript(key, transcript_id):
+    _save(key, {"transcriptId": str(transcript_id)})
+
+
+def save_analysis(key, analysis, prompt_version):
+    _save(key, {"analysis": analysis, "promptVersion": prompt_version})
+
+
+def link_document(key, document_id):
+    _save(key, {"documentId": document_id})
+
+
+def unlink_documents(document_ids):
+    #The document and its stored transcript are gone, the next upload of the file starts over
+    return db.Fingerprints.update_many(
+        {"documentId": {"$in": list(document_ids)}},
+        {"$set": {"documentId": None, "transcriptId": None, "updatedAt": datetime.now()}},
+    ).modified_count
+
+
+def migrate():
+    #Fingerprints written before the transcript store kept the raw text inline. Point them at
+    #their document's stored transcript instead (run after transcripts.migrate), or drop it
+    moved = 0
+    for entry in db.Fingerprints.find({"transcript": {"$exists": True}}, {"documentId": 1}):
+        document_id = entry.get("documentId")
+        transcript_id = document_id if document_id and transcripts.summary(document_id) else None
+        db.Fingerprints.update_one(
+            {"_id": entry["_id"]},
+            {"$set": {"transcriptId": transcript_id}, "$unset": {"transcript": ""}},
+        )
+        moved += 1
+    if moved:
+        logging.info(f"Dropped inline transcripts from {moved} fingerprint(s)")
+    return moved
@@ -0,0 +1,305 @@
+#Background job queue for the upload pipelines.
+#An upload endpoint submits a job and returns right away; a bounded pool of worker
+#threads runs the pipeline stages one after another. Every job lives in the Jobs
+#collection so it survives a restart and resumes from the last completed stage.
+#Each job records the process running it, so with several server workers only jobs whose
+#process is gone get resumed (see resume_jobs). A failed job keeps its inputs and can be
+#retried from the stage that failed for FAILED_JOB_RETRY_HOURS (see retry_job).
+import logging
+import os
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock
+
+from config.db import db
+from services import metrics
+
+#How many pipelines run at the same time
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+#How many jobs can wait in the queue before we start rejecting uploads
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "50"))
+#How long a failed job keeps its uploaded/extracted files and can be retried
+FAILED_JOB_RETRY_HOURS = float(os.getenv("FAILED_JOB_RETRY_HOURS", os.getenv("UPLOAD_RETENTION_HOURS", "24")))
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+SKIPPED = "skipped"
+FAILED = "failed"
+PENDING_STATUSES = [QUEUED, RUNNING]
+#What /jobs needs from a job; params and stage outputs (transcripts, resources) can be huge
+SUMMARY_PROJECTION = {
+    "pipeline": 1, "status": 1, "currentStage": 1, "error": 1, "createdAt": 1, "updatedAt": 1,
+    "stages.name": 1, "stages.status": 1, "stages.error": 1, "stages.startedAt": 1,
+    "stages.finishedAt": 1, "stages.durationSeconds": 1,
+    "data.inserted_id": 1, "data.duplicate": 1,
+}
+
+#Pipeline name -> list of (stage name, stage function)
+#A stage function receives the job document and returns a dict that gets merged into job["data"]
+PIPELINES = {}
+#Pipeline name -> function called with the job once it completes (cleanup); a failed job keeps
+#its files for FAILED_JOB_RETRY_HOURS so it can be retried, then the retention sweep removes them
+FINISH_HOOKS = {}
+
+_executor = None
+_executor_lock = Lock()
+#Job ids that are waiting or running in this process
+_active = set()
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class SkipStage(Exception):
+    #Raised by a stage whose work is already done (e.g. a cached transcript)
+    pass
+
+
+def register_pipeline(name, stages, on_finish=None):
+    PIPELINES[name] = stages
+    if on_finish is not None:
+        FINISH_HOOKS[name] = on_finish
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+        return _executor
+
+
+def _owner():
+    #Called each time rather than cached, server workers are forked after import
+    return {"host": socket.gethostname(), "pid": os.getpid()}
+
+
+def _process_alive(pid):
+    if os.name != "posix":
+        #Signal 0 means CTRL_C_EVENT on Windows, only the single dev server runs there anyway
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_orphaned(job):
+    owner = job.get("owner")
+    if not owner or owner.get("pid") == os.getpid():
+        return True
+    if owner.get("host") != socket.gethostname():
+        #A previous container or machine, it isn't coming back for it
+        return True
+    return not _process_alive(owner["pid"])
+
+
+def _update_job(job_id, fields):
+    fields["updatedAt"] = datetime.now()
+    db.Jobs.update_one({"_id": job_id}, {"$set": fields})
+
+
+def submit_job(pipeline, params):
+    if pipeline not in PIPELINES:
+        raise ValueError(f"Unknown pipeline: {pipeline}")
+    with _executor_lock:
+        if len(_active) >= JOB_QUEUE_LIMIT:
+            raise QueueFullError("Too many uploads are being processed, try again later")
+
+    now = datetime.now()
+    job = {
+        "_id": uuid.uuid4().hex,
+        "pipeline": pipeline,
+        "status": QUEUED,
+        "params": params,
+        "data": {},
+        "stages": [{"name": name, "status": QUEUED} for name, _ in PIPELINES[pipeline]],
+        "currentStage": None,
+        "error": None,
+        "owner": _owner(),
+        "createdAt": now,
+        "updatedAt": now,
+    }
+    db.Jobs.insert_one(job)
+    _enqueue(job["_id"])
+    logging.info(f"Queued job {job['_id']} ({pipeline})")
+    return job
+
+
+def _enqueue(job_id):
+    with _executor_lock:
+        if job_id in _active:
+            return
+        _active.add(job_id)
+    _get_executor().submit(run_job, job_id)
+
+
+def run_job(job_id):
+    try:
+        job = db.Jobs.find_one({"_id": job_id})
+        if job is None:
+            logging.error(f"Job {job_id} disappeared before it could run")
+            return
+        try:
+            _run_stages(job)
+        finally:
+            _finish(job)
+    finally:
+        with _executor_lock:
+            _active.discard(job_id)
+
+
+def _run_stages(job):
+    job_id = job["_id"]
+    stages = PIPELINES[job["pipeline"]]
+    _update_job(job_id, {"status": RUNNING})
+
+    for index, (name, stage_fn) in enumerate(stages):
+        #Skip whatever already finished before a restart
+        if job["stages"][index]["status"] in (COMPLETED, SKIPPED):
+            continue
+
+        started = datetime.now()
+        start_clock = time.perf_counter()
+        _update_job(job_id, {
+            "currentStage": name,
+            f"stages.{index}.status": RUNNING,
+            f"stages.{index}.startedAt": started,
+        })
+        status = COMPLETED
+        labels = {"pipeline": job["pipeline"], "stage": name}
+        metrics.STAGE_IN_FLIGHT.inc(**labels)
+        try:
+            updates = stage_fn(job) or {}
+        except SkipStage:
+            status = SKIPPED
+            updates = {}
+        except Exception as e:
+            logging.error(f"Job {job_id} failed in stage {name}: {e}")
+            metrics.STAGE_TOTAL.inc(status=FAILED, **labels)
+            _update_job(job_id, {
+                "status": FAILED,
+                "error": str(e),
+                "finishedAt": datetime.now(),
+                f"stages.{index}.status": FAILED,
+                f"stages.{index}.error": str(e),
+                f"stages.{index}.traceback": traceback.format_exc(),
+                f"stages.{index}.finishedAt": datetime.now(),
+                f"stages.{index}.durationSeconds": round(time.perf_counter() - start_clock, 3),
+            })
+            return
+        finally:
+            metrics.STAGE_IN_FLIGHT.dec(**labels)
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start_clock, **labels)
+
+        metrics.STAGE_TOTAL.inc(status=status, **labels)
+        duration = round(time.perf_counter() - start_clock, 3)
+        job["data"].update(updates)
+        job["stages"][index].update({"status": status, "durationSeconds": duration})
+        fields = {f"data.{key}": value for key, value in updates.items()}
+        fields.update({
+            f"stages.{index}.status": status,
+            f"stages.{index}.finishedAt": datetime.now(),
+            f"stages.{index}.durationSeconds": duration,
+        })
+        _update_job(job_id, fields)
+
+    #finishedAt is what the TTL index on Jobs expires finished jobs by (see config.indexes)
+    _update_job(job_id, {"status": COMPLETED, "currentStage": None, "finishedAt": datetime.now()})
+    logging.info(f"Job {job_id} completed")
+
+
+def _finish(job):
+    hook = FINISH_HOOKS.get(job["pipeline"])
+    if hook is None:
+        return
+    #A job cut short by a crash stays pending and needs its files when it resumes, a failed one
+    #needs them when it is retried
+    current = db.Jobs.find_one({"_id": job["_id"]}, {"status": 1})
+    if current is None or current["status"] != COMPLETED:
+        return
+    try:
+        hook(job)
+    except Exception as e:
+        logging.error(f"Cleanup for job {job['_id']} failed: {e}")
+
+
+def resume_jobs():
+    #Pick up everything that was queued or running in a process that has since stopped
+    resumed = 0
+    for job in db.Jobs.find({"status": {"$in": PENDING_STATUSES}}, {"_id": 1, "owner": 1}):
+        if job["_id"] in _active or not _is_orphaned(job):
+            continue
+        #Take it over only if nobody else did in the meantime
+        claimed = db.Jobs.update_one({"_id": job["_id"], "owner": job.get("owner")}, {"$set": {"owner": _owner()}})
+        if claimed.modified_count:
+            _enqueue(job["_id"])
+            resumed += 1
+    if resumed:
+        logging.info(f"Resumed {resumed} unfinished job(s)")
+    return resumed
+
+
+def retry_cutoff():
+    #Jobs that failed before this have lost their files to the retention sweep
+    return datetime.now() - timedelta(hours=FAILED_JOB_RETRY_HOURS)
+
+
+def retry_job(job_id):
+    #Queues a failed job again; it starts at the stage that failed since the completed ones are
+    #skipped. Returns None if there's no such job that failed within FAILED_JOB_RETRY_HOURS
+    with _executor_lock:
+        if len(_active) >= JOB_QUEUE_LIMIT:
+            raise QueueFullError("Too many uploads are being processed, try again later")
+    job = db.Jobs.find_one_and_update(
+        {"_id": job_id, "status": FAILED, "finishedAt": {"$gte": retry_cutoff()}},
+        {
+            "$set": {"status": QUEUED, "error": None, "currentStage": None, "owner": _owner(),
+                     "updatedAt": datetime.now(), "stages.$[failed].status": QUEUED},
+            "$unset": {"finishedAt": "", "stages.$[failed].error": "", "stages.$[failed].traceback": ""},
+        },
+        array_filters=[{"failed.status": FAILED}],
+    )
+    if job is None:
+        return None
+    _enqueue(job_id)
+    logging.info(f"Retrying job {job_id} ({job['pipeline']})")
+    return job
+
+
+def get_job(job_id):
+    return db.Jobs.find_one({"_id": job_id}, SUMMARY_PROJECTION)
+
+
+def list_jobs(status=None, limit=50):
+    #Served by the (status, createdAt) and createdAt indexes
+    query = {"status": status} if status else {}
+    return list(db.Jobs.find(query, SUMMARY_PROJECTION).sort("createdAt", -1).limit(limit))
+
+
+def serialize_job(job):
+    #Expects a job loaded with SUMMARY_PROJECTION, so only the inserted document id is exposed
+    stages = []
+    for stage in job["stages"]:
+        stages.append({key: value for key, value in stage.items() if key != "traceback"})
+    return {
+        "job_id": job["_id"],
+        "pipeline": job["pipeline"],
+        "status": job["status"],
+        "currentStage": job.get("currentStage"),
+        "stages": stages,
+        "error": job.get("error"),
+        "inserted_id": job.get("data", {}).get("inserted_id"),
+        "duplicate": job.get("data", {}).get("duplicate", False),
+        "createdAt": job["createdAt"],
+        "updatedAt": job["updatedAt"],
+    }
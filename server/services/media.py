@@ -0,0 +1,112 @@
+#Audio ingestion for the transcriber.
+#Every job gets its own workspace folder (audio/<job id>) so parallel uploads never touch
+#each other's files. The folder is removed when the job completes; a failed job keeps it
+#for FAILED_JOB_RETRY_HOURS so it can be retried, then the retention sweep removes it.
+#YouTube audio is saved as small mono Opus instead of WAV, and audio from uploaded videos
+#is piped out of ffmpeg straight into the AssemblyAI upload, so no decoded copy ever hits
+#the disk. ffmpeg must be on the PATH (it already is for yt-dlp).
+#yt-dlp is only imported when a link is actually downloaded, it's slow to load.
+import logging
+import os
+import shutil
+import subprocess
+from contextlib import contextmanager
+
+from services import metrics
+
+WORKSPACE_ROOT = os.getenv("MEDIA_WORKSPACE_ROOT", "audio")
+#Speech doesn't need more than this: mono, 16kHz, 32kbps Opus is ~14MB per lecture hour
+AUDIO_CODEC = "opus"
+AUDIO_BITRATE_KBPS = "32"
+AUDIO_SAMPLE_RATE = "16000"
+PIPE_READ_SIZE = 64 * 1024
+
+
+def workspace_path(job_id):
+    path = os.path.join(WORKSPACE_ROOT, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def remove_workspace(job_id):
+    shutil.rmtree(os.path.join(WORKSPACE_ROOT, job_id), ignore_errors=True)
+
+
+@contextmanager
+def workspace(job_id):
+    try:
+        yield workspace_path(job_id)
+    finally:
+        remove_workspace(job_id)
+
+
+#Download audio from the video uploaded
+def download_audio(video_url, directory):
+    import yt_dlp
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': os.path.join(directory, 'audio.%(ext)s'),
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': AUDIO_CODEC,
+            'preferredquality': AUDIO_BITRATE_KBPS,
+        }],
+        'postprocessor_args': {'extractaudio': ['-ac', '1', '-ar', AUDIO_SAMPLE_RATE]},
+        'quiet': True,
+    }
+    with metrics.external_call("yt_dlp"), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(video_url, download=True)
+
+    downloads = info.get('requested_downloads') or []
+    if downloads and os.path.exists(downloads[0].get('filepath', '')):
+        return downloads[0]['filepath']
+    #Older yt-dlp versions don't report the post-processed path
+    for name in os.listdir(directory):
+        if name.startswith('audio.'):
+            return os.path.join(directory, name)
+    raise RuntimeError(f"yt-dlp finished but no audio file was found for {video_url}")
+
+
+class _PipeReader:
+    #Only exposes read(), so the HTTP client streams it chunked instead of
+    #asking the pipe for a (meaningless) file size
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def read(self, size=PIPE_READ_SIZE):
+        return self._pipe.read(size)
+
+    def __iter__(self):
+        return iter(lambda: self._pipe.read(PIPE_READ_SIZE), b"")
+
+
+@contextmanager
+def audio_stream(path):
+    #Yields a readable stream of the file's audio track encoded as Ogg/Opus
+    command = [
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-i", path, "-vn", "-ac", "1", "-ar", AUDIO_SAMPLE_RATE,
+        "-c:a", "libopus", "-b:a", f"{AUDIO_BITRATE_KBPS}k", "-f", "ogg", "pipe:1",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        yield _PipeReader(process.stdout)
+    finally:
+        process.stdout.close()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        errors = process.stderr.read().decode("utf-8", "replace").strip()
+        process.stderr.close()
+        if process.returncode not in (0, None) and errors:
+            logging.error(f"ffmpeg failed on {path}: {errors}")
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not extract audio from {path}")
+
+
+def transcribe_media(transcriber, path):
+    #ffmpeg runs while the upload streams, so this covers both
+    with metrics.external_call("assemblyai"), audio_stream(path) as stream:
+        return transcriber.transcribe(stream)
@@ -0,0 +1,271 @@
+#Lightweight counters, gauges and histograms, exposed in Prometheus text format at /metrics.
+#Pipeline stages are timed by the job runner and every call to an outside service
+#(AssemblyAI, Gemini, Google Search, yt-dlp, ffmpeg, Mongo writes) goes through
+#external_call(), which records its latency, errors and how many are in flight, after waiting
+#for the service's rate limit (see services.ratelimit).
+#Values are kept per process. Under gunicorn a scrape reaches one random worker, so with
+#METRICS_DIR set (gunicorn.conf.py does it) every worker writes its values to a file there
+#every METRICS_FLUSH_SECONDS and /metrics adds up the files of all workers. Counters and
+#histograms of a worker that exited stay in the total so they never go backwards; its gauges
+#are dropped (see mark_process_dead).
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from services import ratelimit
+
+#Seconds, sized for everything from a Mongo insert to a three hour transcription
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+#Shared folder for the per-worker files, None keeps everything in this process
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+_registry = []
+_lock = Lock()
+_flush_thread = None
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _samples(self, values):
+        raise NotImplementedError
+
+    def _merge(self, values, other):
+        #Adds another process's values into values
+        for key, value in other.items():
+            values[key] = values[key] + value if key in values else value
+
+    def snapshot(self):
+        with _lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            lines += self._samples(self._values if values is None else values)
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, values):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), merge="sum"):
+        #merge: how the workers' values are combined, "sum" (e.g. in flight) or "max"
+        super().__init__(name, documentation, labelnames)
+        self.merge = merge
+
+    def _merge(self, values, other):
+        if self.merge != "max":
+            return super()._merge(values, other)
+        for key, value in other.items():
+            values[key] = max(values.get(key, value), value)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _merge(self, values, other):
+        for key, (counts, total) in other.items():
+            if key in values:
+                merged_counts, merged_total = values[key]
+                counts = [a + b for a, b in zip(merged_counts, counts)]
+                total += merged_total
+            values[key] = (list(counts), total)
+
+    def _samples(self, values):
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                le = 'le="' + _format_number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("studyez_stage_duration_seconds", "Time spent in each pipeline stage", ["pipeline", "stage"])
+STAGE_TOTAL = Counter("studyez_stage_total", "Pipeline stages run, by outcome", ["pipeline", "stage", "status"])
+STAGE_IN_FLIGHT = Gauge("studyez_stage_in_flight", "Pipeline stages running right now", ["pipeline", "stage"])
+
+EXTERNAL_SECONDS = Histogram("studyez_external_call_duration_seconds", "Latency of calls to outside services", ["service"])
+EXTERNAL_TOTAL = Counter("studyez_external_calls_total", "Calls to outside services", ["service"])
+EXTERNAL_ERRORS = Counter("studyez_external_call_errors_total", "Calls to outside services that raised", ["service"])
+EXTERNAL_IN_FLIGHT = Gauge("studyez_external_calls_in_flight", "Calls to outside services waiting for an answer", ["service"])
+
+STARTUP_SECONDS = Gauge("studyez_startup_seconds", "Time the slowest worker took to import the app", merge="max")
+HTTP_SECONDS = Histogram("studyez_http_request_duration_seconds", "HTTP request latency", ["method", "endpoint", "status"])
+
+
+@contextmanager
+def external_call(service):
+    #Time spent waiting on our own rate limit isn't the service's latency
+    ratelimit.acquire(service)
+    EXTERNAL_TOTAL.inc(service=service)
+    EXTERNAL_IN_FLIGHT.inc(service=service)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_ERRORS.inc(service=service)
+        raise
+    finally:
+        EXTERNAL_IN_FLIGHT.dec(service=service)
+        EXTERNAL_SECONDS.observe(time.perf_counter() - started, service=service)
+
+
+def _path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def _write(path, data):
+    #Written to a temporary file first so a scrape never reads half a file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def flush():
+    #Writes this process's values to METRICS_DIR
+    with _lock:
+        metrics = list(_registry)
+    data = {metric.name: {"kind": metric.kind, "values": metric.snapshot()} for metric in metrics}
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write(_path(os.getpid()), data)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception as e:
+            logging.error(f"Could not write metrics to {METRICS_DIR}: {e}")
+
+
+def start_flushing():
+    #Called once in every server worker, does nothing without METRICS_DIR
+    global _flush_thread
+    if METRICS_DIR and _flush_thread is None:
+        _flush_thread = threading.Thread(target=_flush_loop, name="metrics", daemon=True)
+        _flush_thread.start()
+
+
+def mark_process_dead(pid):
+    #Called by the gunicorn master when a worker exits: its gauges (in flight calls etc.) no
+    #longer mean anything, its counters still count
+    path = _path(pid)
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    _write(path, {name: entry for name, entry in data.items() if entry["kind"] != "gauge"})
+
+
+def clear():
+    #Called by the gunicorn master on start, values from a previous run would be counted again
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+def _collect():
+    #{metric name: values of all processes added up}
+    flush()
+    merged = {}
+    with _lock:
+        by_name = {metric.name: metric for metric in _registry}
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric_name, entry in data.items():
+            metric = by_name.get(metric_name)
+            if metric is None:
+                continue
+            values = {tuple(key): tuple(value) if isinstance(value, list) else value for key, value in entry["values"]}
+            metric._merge(merged.setdefault(metric_name, {}), values)
+    return merged
+
+
+def render():
+    with _lock:
+        metrics = list(_registry)
+    merged = _collect() if METRICS_DIR else None
+    lines = []
+    for metric in metrics:
+        lines += metric.render(merged.get(metric.name, {}) if merged is not None else None)
+    return "\n".join(lines) + "\n"
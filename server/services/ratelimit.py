@@ -0,0 +1,62 @@
+#Per-service rate limits for calls to outside services.
+#metrics.external_call() asks here before every call, so one setting covers the server and
+#the batch importer alike. Limits are calls per minute, from RATE_LIMITS in the environment
+#(e.g. RATE_LIMITS=gemini=60,google_search=100) or set_limit(); services without a limit
+#are never held back. Limits are per process.
+import os
+import time
+from threading import Lock
+
+_limiters = {}
+_lock = Lock()
+
+
+class TokenBucket:
+    #Allows short bursts up to one second's worth of calls, then spaces them out evenly
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def set_limit(service, per_minute):
+    #None or 0 removes the limit
+    with _lock:
+        if per_minute:
+            _limiters[service] = TokenBucket(per_minute)
+        else:
+            _limiters.pop(service, None)
+
+
+def parse_limits(value):
+    #"gemini=60,google_search=100" -> {"gemini": 60.0, "google_search": 100.0}
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            service, per_minute = item.split("=", 1)
+            limits[service.strip()] = float(per_minute)
+    return limits
+
+
+def acquire(service):
+    limiter = _limiters.get(service)
+    if limiter is not None:
+        limiter.acquire()
+
+
+for _service, _per_minute in parse_limits(os.getenv("RATE_LIMITS")).items():
+    set_limit(_service, _per_minute)
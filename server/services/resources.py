@@ -0,0 +1,209 @@
+#Finds a YouTube video and a web article for every subtopic with Google Custom Search.
+#All queries of an upload go out at once over one pooled session, answers are cached in
+#the SearchCache collection so a subtopic we've seen before never hits the API again,
+#and rate limit / quota errors back off instead of failing the whole upload.
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from config.db import db
+from services import metrics
+
+load_dotenv()
+
+#Google API Key for web searching
+GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+#Id of the custom search engine
+GOOGLE_CSE_ID = os.getenv('GOOGLE_CSE_ID')
+#Can be pointed at a local stub server for testing
+GOOGLE_SEARCH_URL = os.getenv('GOOGLE_SEARCH_URL', 'https://www.googleapis.com/customsearch/v1')
+
+#Max number of search requests in flight at once (across all uploads)
+SEARCH_CONCURRENCY = int(os.getenv('SEARCH_CONCURRENCY', '8'))
+#How long a cached search answer stays valid
+SEARCH_CACHE_TTL_DAYS = int(os.getenv('SEARCH_CACHE_TTL_DAYS', '30'))
+SEARCH_MAX_RETRIES = int(os.getenv('SEARCH_MAX_RETRIES', '4'))
+SEARCH_TIMEOUT_SECONDS = float(os.getenv('SEARCH_TIMEOUT_SECONDS', '10'))
+#Longest we sleep between retries, whatever Retry-After says
+SEARCH_MAX_RETRY_DELAY = int(os.getenv('SEARCH_MAX_RETRY_DELAY', '30'))
+#When the daily quota runs out we stop calling the API for this long (a long Retry-After only
+#pauses it for as long as it asks)
+QUOTA_COOLDOWN_SECONDS = int(os.getenv('QUOTA_COOLDOWN_SECONDS', '3600'))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+QUOTA_REASONS = {'dailyLimitExceeded', 'quotaExceeded'}
+
+#One session for every search so connections get reused
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=SEARCH_CONCURRENCY))
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=SEARCH_CONCURRENCY))
+
+_executor = ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY, thread_name_prefix="search")
+_quota_lock = Lock()
+_quota_exhausted_until = 0.0
+_cache_index_ready = False
+
+SEARCH_CACHE = metrics.Counter("studyez_search_cache_total", "Google searches answered from the cache or not", ["result"])
+
+
+def normalize_query(query):
+    #"  Big-O   Notation " and "big-o notation" should share a cache entry
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def cache_key(query, site_restrict=None):
+    return f"{site_restrict or ''}|{normalize_query(query)}"
+
+
+def _ensure_cache_index():
+    #Mongo drops expired entries on its own once the TTL index exists
+    global _cache_index_ready
+    if not _cache_index_ready:
+        db.SearchCache.create_index("expiresAt", expireAfterSeconds=0)
+        _cache_index_ready = True
+
+
+def _get_cached(key):
+    entry = db.SearchCache.find_one({"_id": key, "expiresAt": {"$gt": datetime.now()}})
+    return entry["response"] if entry else None
+
+
+def _set_cached(key, response):
+    _ensure_cache_index()
+    db.SearchCache.update_one(
+        {"_id": key},
+        {"$set": {"response": response, "expiresAt": datetime.now() + timedelta(days=SEARCH_CACHE_TTL_DAYS)}},
+        upsert=True,
+    )
+
+
+def invalidate_cached(queries):
+    #Forget cached answers so the next lookup asks Google again
+    keys = [cache_key(query, site) for query in queries for site in (None, "youtube.com")]
+    return db.SearchCache.delete_many({"_id": {"$in": keys}}).deleted_count
+
+
+def _error_reason(response):
+    try:
+        errors = response.json().get("error", {}).get("errors", [])
+        return errors[0].get("reason") if errors else None
+    except ValueError:
+        return None
+
+
+def _quota_exhausted():
+    with _quota_lock:
+        return time.time() < _quota_exhausted_until
+
+
+def _mark_quota_exhausted(seconds=QUOTA_COOLDOWN_SECONDS):
+    #Never shortens a pause that is already longer
+    global _quota_exhausted_until
+    with _quota_lock:
+        _quota_exhausted_until = max(_quota_exhausted_until, time.time() + seconds)
+    logging.error(f"Google Search paused for {seconds}s")
+
+
+def _retry_delay(response, attempt):
+    #Retry-After as the server sent it (may be more than SEARCH_MAX_RETRY_DELAY), else a capped backoff
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    return min(2 ** attempt, SEARCH_MAX_RETRY_DELAY)
+
+
+def google_search(query, site_restrict=None):
+    key = cache_key(query, site_restrict)
+    cached = _get_cached(key)
+    if cached is not None:
+        SEARCH_CACHE.inc(result="hit")
+        return cached
+    SEARCH_CACHE.inc(result="miss")
+
+    if _quota_exhausted():
+        logging.warning(f"Skipping search for '{query}', searches are paused")
+        return {}
+
+    params = {
+        'key': GOOGLE_API_KEY,
+        'cx': GOOGLE_CSE_ID,
+        'q': query,
+        'num': 1  # Limit to 1 result
+    }
+    if site_restrict:
+        params['siteSearch'] = site_restrict
+
+    for attempt in range(SEARCH_MAX_RETRIES + 1):
+        response = None
+        try:
+            with metrics.external_call("google_search"):
+                response = session.get(GOOGLE_SEARCH_URL, params=params, timeout=SEARCH_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            logging.warning(f"Google Search request failed: {e}")
+
+        if response is not None and response.status_code == 200:
+            result = response.json()
+            _set_cached(key, result)
+            return result
+
+        if response is not None:
+            reason = _error_reason(response)
+            if response.status_code == 403 and reason in QUOTA_REASONS:
+                _mark_quota_exhausted()
+                return {}
+            retryable = response.status_code in RETRY_STATUS_CODES or reason in RATE_LIMIT_REASONS
+            if not retryable:
+                logging.error(f"Google Search API Error: {response.status_code}")
+                return {}
+
+        if attempt < SEARCH_MAX_RETRIES:
+            delay = _retry_delay(response, attempt)
+            if delay > SEARCH_MAX_RETRY_DELAY:
+                #Too long to hold a search thread; pause every search until then, not for the
+                #whole daily-quota cooldown
+                _mark_quota_exhausted(delay)
+                return {}
+            logging.warning(f"Google Search throttled, retrying '{query}' in {delay}s")
+            time.sleep(delay)
+
+    logging.error(f"Google Search gave up on '{query}' after {SEARCH_MAX_RETRIES + 1} attempts")
+    return {}
+
+
+def search_resources(subtopics):
+    #Fire off both searches for every subtopic at once instead of one after another
+    youtube_futures = [_executor.submit(google_search, topic, "youtube.com") for topic in subtopics]
+    google_futures = [_executor.submit(google_search, topic) for topic in subtopics]
+
+    topic_resources = []
+    for topic, youtube_future, google_future in zip(subtopics, youtube_futures, google_futures):
+        youtube = ""
+        google = ""
+        # 1 YouTube video
+        youtube_result = youtube_future.result()
+        if youtube_result.get('items'):
+            youtube = youtube_result['items'][0]['link']
+
+        # 1 non-YouTube resource
+        non_video_result = google_future.result()
+        for item in non_video_result.get('items', []):
+            if "youtube.com" not in item['link']:
+                google = item['link']
+                break
+
+        topic_resources.append({
+            "topic": topic,
+            "googleLink": google,
+            "youtubeLink": youtube,
+        })
+
+    return topic_resources
@@ -0,0 +1,85 @@
+#Retention policy for uploads/ and audio/.
+#Files are normally removed as soon as their job finishes; this sweep catches what's left
+#behind by crashes, failed jobs and abandoned chunked uploads. Anything older than the max
+#age that no pending job, recently failed job (kept jobs.FAILED_JOB_RETRY_HOURS so it can be
+#retried) or open upload session still needs gets deleted.
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+from config.db import db
+from services import jobs, media, uploads
+
+UPLOAD_RETENTION_HOURS = float(os.getenv("UPLOAD_RETENTION_HOURS", "24"))
+#Open chunked uploads nobody touched for this long are abandoned
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "48"))
+RETENTION_SWEEP_MINUTES = float(os.getenv("RETENTION_SWEEP_MINUTES", "30"))
+
+_thread = None
+
+
+def _protected_names():
+    #File/folder names in uploads/ and audio/ that something still needs
+    names = set()
+    query = {"$or": [
+        {"status": {"$in": jobs.PENDING_STATUSES}},
+        {"status": jobs.FAILED, "finishedAt": {"$gte": jobs.retry_cutoff()}},
+    ]}
+    for job in db.Jobs.find(query, {"params.file_path": 1}):
+        names.add(job["_id"])
+        file_path = job.get("params", {}).get("file_path")
+        if file_path:
+            names.add(os.path.basename(file_path))
+    cutoff = datetime.now() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    for session in db.UploadSessions.find({"status": uploads.OPEN, "updatedAt": {"$gte": cutoff}}, {"ext": 1}):
+        names.add(os.path.basename(uploads.part_path(session["_id"], session["ext"])))
+    return names
+
+
+def expire_sessions():
+    cutoff = datetime.now() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    result = db.UploadSessions.delete_many({"status": uploads.OPEN, "updatedAt": {"$lt": cutoff}})
+    return result.deleted_count
+
+
+def sweep(max_age_hours=UPLOAD_RETENTION_HOURS):
+    expired = expire_sessions()
+    protected = _protected_names()
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for folder in (uploads.UPLOAD_FOLDER, media.WORKSPACE_ROOT):
+        if not os.path.isdir(folder):
+            continue
+        for entry in os.scandir(folder):
+            if entry.name in protected or entry.stat().st_mtime > cutoff:
+                continue
+            try:
+                if entry.is_dir():
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+                removed += 1
+            except OSError as e:
+                logging.warning(f"Retention sweep could not remove {entry.path}: {e}")
+    if removed or expired:
+        logging.info(f"Retention sweep removed {removed} file(s) and {expired} abandoned upload(s)")
+    return removed
+
+
+def _loop():
+    while True:
+        try:
+            sweep()
+        except Exception as e:
+            logging.error(f"Retention sweep failed: {e}")
+        time.sleep(RETENTION_SWEEP_MINUTES * 60)
+
+
+def start():
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_loop, name="retention", daemon=True)
+        _thread.start()
@@ -0,0 +1,806 @@
+#In-app search over lectures.
+#An inverted index (term -> document -> word positions) over transcript, summary and
+#topicsCovered; transcripts are read from the compressed store (services.transcripts).
+#The bulk of it is a snapshot file in SEARCH_INDEX_DIR that every server process maps
+#read-only with mmap, so the OS keeps one copy in memory for all gunicorn workers instead of
+#one per worker. Only the process doing the background work (see services.background) builds
+#and rewrites it; set_writer() gives it that role. Documents stored or deleted since the
+#snapshot are kept in a small in-memory index in each process. A background thread in every
+#process (keep_in_sync) re-syncs it with Mongo every SEARCH_INDEX_REFRESH_SECONDS, never a
+#search request: documents whose updatedAt moved are re-indexed, and deletions are read from
+#the SearchDeletions tombstones that delete_documents() writes. The writer folds it all into a
+#new snapshot every SEARCH_INDEX_PUBLISH_SECONDS.
+#Ranking is BM25, "quoted phrases" must match word for word, and snippets come back with
+#the matching words wrapped in <mark>. Scoring the snapshot is vectorized when NumPy is
+#installed, which also gives every lecture a hashed bag-of-words embedding so we can
+#suggest related lectures. Nothing here needs network access.
+#python -m benchmarks.bench_search checks search latency on a generated corpus.
+import bisect
+import html
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import time
+import zlib
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime
+from threading import Lock, RLock
+
+from bson import ObjectId
+
+from config.db import db
+from services import transcripts
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_CHARS = 160
+EMBEDDING_DIMS = 512
+#How often the background thread picks up writes from other processes
+SEARCH_INDEX_REFRESH_SECONDS = int(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", "30"))
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "search_index")
+#How often the writer folds the in-memory changes into a new snapshot
+SEARCH_INDEX_PUBLISH_SECONDS = int(os.getenv("SEARCH_INDEX_PUBLISH_SECONDS", "300"))
+#Documents whose updatedAt is this close to the last sync get looked at again, in case the
+#clocks of two servers or a write and our query overlap
+SYNC_SLACK_SECONDS = 5
+#While building from scratch, write a snapshot every this many documents so the writer's
+#in-memory part never holds the whole corpus
+SEARCH_INDEX_BUILD_DOCS = int(os.getenv("SEARCH_INDEX_BUILD_DOCS", "5000"))
+
+TOKEN_RE = re.compile(r"\w+")
+PHRASE_RE = re.compile(r'"([^"]+)"')
+#Only what we need to index, never the whole document
+INDEX_PROJECTION = {"transcript": 1, "summary": 1, "topicsCovered": 1, "updatedAt": 1}
+BUILD_BATCH_SIZE = 100
+
+#Snapshot layout: header (counts, the time the writer last synced with Mongo, section offsets), then 9 sections each starting on an 8 byte boundary:
+#doc ids (24 ascii bytes each, sorted), doc lengths (uint32), vectors (float32, dims per doc),
+#term offsets (uint64, n_terms + 1), term bytes (utf-8, sorted), posting offsets per term
+#(uint64, n_terms + 1), posting doc numbers (uint32, ascending per term), position offsets
+#per posting (uint64, n_postings + 1), positions (uint32)
+SNAPSHOT_MAGIC = b"SIDX\x00\x00\x00\x01"
+HEADER = struct.Struct("<8s6Qd9Q")
+ID_BYTES = 24
+CURRENT_FILE = "CURRENT"
+#Snapshots kept on disk, a process may still be opening the previous one
+KEEP_SNAPSHOTS = 2
+
+_lock = RLock()
+#Only one refresh at a time per process
+_refresh_lock = Lock()
+#The mapped snapshot, or None until one is opened
+_base = None
+#Snapshot doc id -> doc number for documents deleted or replaced since the snapshot
+_deleted = {}
+_deleted_length = 0
+#The in-memory part: documents added since the snapshot
+#term -> {doc id: array of positions}
+_postings = defaultdict(dict)
+#doc id -> number of tokens
+_doc_lengths = {}
+#doc id -> terms it appears under, so a delete only touches its own postings
+_doc_terms = {}
+_total_length = 0
+#doc id -> updatedAt (epoch seconds) of the version we indexed
+_versions = {}
+#doc id -> row in _vectors, the matrix grows by doubling and only the first len(_row_ids) rows are used
+_vector_rows = {}
+_row_ids = []
+_vectors = None
+_writer = False
+_last_publish = 0.0
+#Documents updated before this (epoch seconds) are known to be indexed as they are now
+_synced_at = 0.0
+
+
+class IndexNotReadyError(Exception):
+    #The writer hasn't published the first snapshot yet
+    pass
+
+
+class _Snapshot:
+    #Read-only view of a snapshot file; nothing is copied out of the mapping up front
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_docs, self.n_terms, self.n_postings, n_positions, self.total_length, self.dims,
+         self.synced_at, *offsets) = HEADER.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a search index snapshot of this version")
+        view = memoryview(self._mm)
+
+        def section(index, count, code):
+            start = offsets[index]
+            return view[start:start + count * struct.calcsize(code)].cast(code)
+
+        #Ids and terms are compared as bytes, which slicing the mmap itself gives us
+        self._ids_start = offsets[0]
+        self._terms_start = offsets[4]
+        self.lengths = section(1, self.n_docs, "I")
+        self.term_offsets = section(3, self.n_terms + 1, "Q")
+        self.posting_offsets = section(5, self.n_terms + 1, "Q")
+        self.posting_docs = section(6, self.n_postings, "I")
+        self.position_offsets = section(7, self.n_postings + 1, "Q")
+        self.positions = section(8, n_positions, "I")
+        self.vectors = None
+        if np is not None:
+            self.np_lengths = np.frombuffer(self._mm, np.uint32, self.n_docs, offsets[1])
+            self.np_posting_docs = np.frombuffer(self._mm, np.uint32, self.n_postings, offsets[6])
+            self.np_position_offsets = np.frombuffer(self._mm, np.uint64, self.n_postings + 1, offsets[7])
+            if self.dims:
+                self.vectors = np.frombuffer(self._mm, np.float32, self.n_docs * self.dims, offsets[2]).reshape(
+                    self.n_docs, self.dims)
+
+    def _id_bytes(self, number):
+        start = self._ids_start + number * ID_BYTES
+        return self._mm[start:start + ID_BYTES]
+
+    def doc_id(self, number):
+        return self._id_bytes(number).decode("ascii")
+
+    def doc_ids(self):
+        return (self.doc_id(number) for number in range(self.n_docs))
+
+    def find_doc(self, doc_id):
+        key = doc_id.encode("ascii")
+        low, high = 0, self.n_docs
+        while low < high:
+            middle = (low + high) // 2
+            if self._id_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_docs and self._id_bytes(low) == key:
+            return low
+        return None
+
+    def term(self, index):
+        return self._mm[self._terms_start + self.term_offsets[index]:self._terms_start + self.term_offsets[index + 1]]
+
+    def find_term(self, term):
+        #(first posting, end) of the term, or None
+        key = term.encode("utf-8")
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_terms and self.term(low) == key:
+            return self.posting_offsets[low], self.posting_offsets[low + 1]
+        return None
+
+    def term_positions(self, posting):
+        return self.positions[self.position_offsets[posting]:self.position_offsets[posting + 1]]
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def document_text(doc):
+    topics = doc.get("topicsCovered") or []
+    if not isinstance(topics, list):
+        topics = [topics]
+    parts = [", ".join(topics), doc.get("summary") or "", doc.get("transcript") or ""]
+    return "\n".join(part for part in parts if part)
+
+
+def _embed(tokens):
+    #Signed feature hashing of log term frequencies, normalized so a dot product is cosine similarity
+    vector = np.zeros(EMBEDDING_DIMS, dtype=np.float32)
+    for term, count in Counter(tokens).items():
+        h = zlib.crc32(term.encode("utf-8"))
+        vector[h % EMBEDDING_DIMS] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + math.log(count))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _set_vector(doc_id, tokens):
+    global _vectors
+    vector = _embed(tokens)
+    if doc_id not in _vector_rows:
+        if _vectors is None:
+            _vectors = np.zeros((64, EMBEDDING_DIMS), dtype=np.float32)
+        elif len(_row_ids) == len(_vectors):
+            _vectors = np.vstack([_vectors, np.zeros_like(_vectors)])
+        _vector_rows[doc_id] = len(_row_ids)
+        _row_ids.append(doc_id)
+    _vectors[_vector_rows[doc_id]] = vector
+
+
+def _drop_vector(doc_id):
+    row = _vector_rows.pop(doc_id, None)
+    if row is None:
+        return
+    #Move the last row into the hole so the used rows stay contiguous
+    last_id = _row_ids.pop()
+    if last_id != doc_id:
+        _vectors[row] = _vectors[len(_row_ids)]
+        _row_ids[row] = last_id
+        _vector_rows[last_id] = row
+
+
+def _hide_base_document(doc_id):
+    global _deleted_length
+    if _base is None or doc_id in _deleted:
+        return
+    number = _base.find_doc(doc_id)
+    if number is not None:
+        _deleted[doc_id] = number
+        _deleted_length += _base.lengths[number]
+
+
+def _version(doc):
+    updated = doc.get("updatedAt")
+    return updated.timestamp() if updated else 0.0
+
+
+def add_document(doc):
+    global _total_length
+    doc_id = str(doc["_id"])
+    tokens = tokenize(document_text(doc))
+    positions = defaultdict(lambda: array("I"))
+    for position, term in enumerate(tokens):
+        positions[term].append(position)
+
+    with _lock:
+        remove_document(doc_id)
+        for term, term_positions in positions.items():
+            _postings[term][doc_id] = term_positions
+        _doc_terms[doc_id] = list(positions)
+        _doc_lengths[doc_id] = len(tokens)
+        _versions[doc_id] = _version(doc)
+        _total_length += len(tokens)
+        if np is not None:
+            _set_vector(doc_id, tokens)
+
+
+def _remove_from_memory(doc_id):
+    global _total_length
+    if doc_id not in _doc_lengths:
+        return
+    for term in _doc_terms.pop(doc_id, []):
+        postings = _postings.get(term)
+        if postings is not None:
+            postings.pop(doc_id, None)
+            if not postings:
+                del _postings[term]
+    _total_length -= _doc_lengths.pop(doc_id)
+    _versions.pop(doc_id, None)
+    if np is not None:
+        _drop_vector(doc_id)
+
+
+def remove_document(doc_id):
+    doc_id = str(doc_id)
+    with _lock:
+        _remove_from_memory(doc_id)
+        _hide_base_document(doc_id)
+
+
+def remove_documents(doc_ids):
+    for doc_id in doc_ids:
+        remove_document(doc_id)
+
+
+def _add_with_transcripts(docs):
+    #Transcripts are stored apart from the documents, fetch them for the whole batch at once
+    if not docs:
+        return
+    texts = transcripts.load_many([doc["_id"] for doc in docs])
+    for doc in docs:
+        doc["transcript"] = texts.get(str(doc["_id"]), "")
+        add_document(doc)
+
+
+def _current_path():
+    try:
+        with open(os.path.join(SEARCH_INDEX_DIR, CURRENT_FILE), encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(SEARCH_INDEX_DIR, name) if name else None
+
+
+def _swap(snapshot, published=False):
+    #Switches to a newer snapshot. The writer just wrote everything it had into it; any other
+    #process keeps what the snapshot doesn't cover yet
+    global _base, _deleted, _deleted_length, _synced_at
+    with _lock:
+        hidden = {}
+        if published:
+            for doc_id in list(_doc_lengths):
+                _remove_from_memory(doc_id)
+        else:
+            #Documents deleted here that the writer hadn't caught up with yet
+            for doc_id in _deleted:
+                number = snapshot.find_doc(doc_id)
+                if number is not None and doc_id not in _doc_lengths:
+                    hidden[doc_id] = number
+            for doc_id in list(_doc_lengths):
+                number = snapshot.find_doc(doc_id)
+                if number is None:
+                    continue
+                if _versions[doc_id] < snapshot.synced_at - SYNC_SLACK_SECONDS:
+                    _remove_from_memory(doc_id)
+                else:
+                    #Might be newer than the snapshot's copy, keep ours
+                    hidden[doc_id] = number
+        if _base is None:
+            _synced_at = snapshot.synced_at
+        _base = snapshot
+        _deleted = hidden
+        _deleted_length = sum(snapshot.lengths[number] for number in hidden.values())
+
+
+def _open_current():
+    #Maps the latest published snapshot if it's newer than ours; False if there is none yet
+    path = _current_path()
+    if path is None:
+        return False
+    if _base is not None and _base.path == path:
+        return True
+    try:
+        snapshot = _Snapshot(path)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not open search index snapshot {path}: {e}")
+        return False
+    _swap(snapshot)
+    return True
+
+
+def _merged_terms():
+    #(term bytes, snapshot posting range or None, in-memory postings or None) in term order
+    memory_terms = sorted((term.encode("utf-8"), term) for term in _postings)
+    base_count = _base.n_terms if _base is not None else 0
+    base_index = 0
+    memory_index = 0
+    while base_index < base_count or memory_index < len(memory_terms):
+        base_term = _base.term(base_index) if base_index < base_count else None
+        memory_term = memory_terms[memory_index][0] if memory_index < len(memory_terms) else None
+        if memory_term is None or (base_term is not None and base_term < memory_term):
+            yield base_term, (_base.posting_offsets[base_index], _base.posting_offsets[base_index + 1]), None
+            base_index += 1
+        elif base_term is None or memory_term < base_term:
+            yield memory_term, None, _postings[memory_terms[memory_index][1]]
+            memory_index += 1
+        else:
+            yield (base_term, (_base.posting_offsets[base_index], _base.posting_offsets[base_index + 1]),
+                   _postings[memory_terms[memory_index][1]])
+            base_index += 1
+            memory_index += 1
+
+
+def _write_snapshot(path):
+    #Writes the snapshot minus deleted documents plus the in-memory ones to a new file,
+    #term by term, without loading the old snapshot's postings all at once
+    kept = [doc_id for doc_id in (_base.doc_ids() if _base is not None else [])
+            if doc_id not in _deleted and doc_id not in _doc_lengths]
+    doc_ids = sorted(set(kept) | set(_doc_lengths))
+    numbers = {doc_id: number for number, doc_id in enumerate(doc_ids)}
+    #Old doc number -> new doc number, -1 for documents that are dropped
+    renumber = array("i", [-1]) * (_base.n_docs if _base is not None else 0)
+    for doc_id in kept:
+        renumber[_base.find_doc(doc_id)] = numbers[doc_id]
+
+    with_vectors = np is not None
+    lengths = array("I", (_doc_lengths[d] if d in _doc_lengths else _base.lengths[_base.find_doc(d)] for d in doc_ids))
+    sections = [path + f".{i}" for i in range(9)]
+    files = [open(section, "wb") for section in sections]
+    try:
+        files[0].write("".join(doc_ids).encode("ascii"))
+        lengths.tofile(files[1])
+        if with_vectors:
+            for doc_id in doc_ids:
+                if doc_id in _vector_rows:
+                    files[2].write(_vectors[_vector_rows[doc_id]].tobytes())
+                elif _base is not None and _base.vectors is not None:
+                    files[2].write(_base.vectors[_base.find_doc(doc_id)].tobytes())
+                else:
+                    files[2].write(bytes(EMBEDDING_DIMS * 4))
+
+        term_offsets = array("Q", [0])
+        posting_offsets = array("Q", [0])
+        position_offsets = array("Q", [0])
+        n_terms = n_postings = n_positions = 0
+        for term, base_range, memory_postings in _merged_terms():
+            postings = []
+            if base_range is not None:
+                for posting in range(*base_range):
+                    number = renumber[_base.posting_docs[posting]]
+                    if number >= 0:
+                        postings.append((number, _base.term_positions(posting)))
+            if memory_postings:
+                postings += [(numbers[doc_id], positions) for doc_id, positions in memory_postings.items()]
+            if not postings:
+                continue
+            postings.sort(key=lambda item: item[0])
+            files[4].write(term)
+            term_offsets.append(term_offsets[-1] + len(term))
+            array("I", (number for number, _ in postings)).tofile(files[6])
+            for _, positions in postings:
+                files[8].write(positions.tobytes())
+                n_positions += len(positions)
+                position_offsets.append(n_positions)
+            n_postings += len(postings)
+            posting_offsets.append(n_postings)
+            n_terms += 1
+        term_offsets.tofile(files[3])
+        posting_offsets.tofile(files[5])
+        position_offsets.tofile(files[7])
+    finally:
+        for f in files:
+            f.close()
+
+    total_length = sum(lengths)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(bytes(HEADER.size))
+        offsets = []
+        for section in sections:
+            out.write(bytes(-out.tell() % 8))
+            offsets.append(out.tell())
+            with open(section, "rb") as f:
+                while True:
+                    block = f.read(1024 * 1024)
+                    if not block:
+                        break
+                    out.write(block)
+            os.remove(section)
+        out.seek(0)
+        out.write(HEADER.pack(SNAPSHOT_MAGIC, len(doc_ids), n_terms, n_postings, n_positions, total_length,
+                              EMBEDDING_DIMS if with_vectors else 0, _synced_at, *offsets))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+
+
+def _prune():
+    names = sorted(name for name in os.listdir(SEARCH_INDEX_DIR) if name.startswith("index-") and name.endswith(".bin"))
+    for name in names[:-KEEP_SNAPSHOTS]:
+        try:
+            #Processes that still map it keep reading it, the OS frees it once they let go
+            os.remove(os.path.join(SEARCH_INDEX_DIR, name))
+        except OSError:
+            pass
+
+
+def publish():
+    #Writer only: folds the in-memory changes into a new snapshot and tells the others about it
+    #Searches in this process wait for it; the other processes keep using the old snapshot
+    global _last_publish
+    with _lock:
+        started = time.perf_counter()
+        os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+        name = f"index-{time.time_ns()}.bin"
+        path = os.path.join(SEARCH_INDEX_DIR, name)
+        _write_snapshot(path)
+        _swap(_Snapshot(path), published=True)
+        current = os.path.join(SEARCH_INDEX_DIR, CURRENT_FILE)
+        with open(current + ".tmp", "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(current + ".tmp", current)
+        _last_publish = time.monotonic()
+    _prune()
+    logging.info(f"Search index snapshot with {_base.n_docs} document(s) written in {time.perf_counter() - started:.2f}s")
+
+
+def set_writer(writer=True):
+    global _writer
+    _writer = writer
+
+
+def build():
+    #Writer only: indexes every document in Mongo from scratch
+    global _synced_at
+    started = time.perf_counter()
+    with _lock:
+        _synced_at = time.time()
+        batch = []
+        for doc in db.Documents.find({}, INDEX_PROJECTION).batch_size(BUILD_BATCH_SIZE):
+            batch.append(doc)
+            if len(batch) == BUILD_BATCH_SIZE:
+                _add_with_transcripts(batch)
+                batch = []
+                if len(_doc_lengths) >= SEARCH_INDEX_BUILD_DOCS:
+                    publish()
+        _add_with_transcripts(batch)
+        publish()
+    logging.info(f"Search index built with {_base.n_docs} document(s) in {time.perf_counter() - started:.2f}s")
+
+
+def refresh(wait=False):
+    #Pick up a newer snapshot, then what changed in Mongo since the last sync: documents stored
+    #or re-analyzed (updatedAt) and documents deleted (SearchDeletions). Returns False without
+    #doing anything if another thread is already refreshing and wait is False
+    global _synced_at
+    if not _refresh_lock.acquire(blocking=wait):
+        return False
+    try:
+        _open_current()
+        started = time.time()
+        since = datetime.fromtimestamp(_synced_at - SYNC_SLACK_SECONDS)
+        deleted = [entry["documentId"] for entry in db.SearchDeletions.find({"deletedAt": {"$gte": since}}, {"documentId": 1})]
+        changed = list(db.Documents.find({"updatedAt": {"$gte": since}}, INDEX_PROJECTION))
+        remove_documents(deleted)
+        with _lock:
+            changed = [doc for doc in changed if _versions.get(str(doc["_id"]), -1.0) < _version(doc)]
+        _add_with_transcripts(changed)
+        _synced_at = started
+        return True
+    finally:
+        _refresh_lock.release()
+
+
+def delete_documents(doc_ids):
+    #Call after removing documents from Documents: leaves a tombstone for the other processes'
+    #refresh, then drops them from this process's index
+    doc_ids = [str(doc_id) for doc_id in doc_ids]
+    if doc_ids:
+        now = datetime.now()
+        db.SearchDeletions.insert_many([{"documentId": doc_id, "deletedAt": now} for doc_id in doc_ids])
+    remove_documents(doc_ids)
+
+
+def _reconcile():
+    #Writer only, before publishing: a full id comparison with Documents as a safety net for
+    #writes that skipped updatedAt or the tombstones (e.g. edits by hand in the Mongo shell)
+    stored = {str(doc["_id"]) for doc in db.Documents.find({}, {"_id": 1})}
+    with _lock:
+        base = _base
+        indexed = set(_doc_lengths)
+        deleted = set(_deleted)
+    indexed.update(doc_id for doc_id in base.doc_ids() if doc_id not in deleted)
+    remove_documents(indexed - stored)
+    missing = [ObjectId(doc_id) for doc_id in stored - indexed]
+    if missing:
+        _add_with_transcripts(list(db.Documents.find({"_id": {"$in": missing}}, INDEX_PROJECTION)))
+
+
+def publish_if_changed():
+    #Called by the writer from the background loop
+    if not _writer or _base is None or time.monotonic() - _last_publish < SEARCH_INDEX_PUBLISH_SECONDS:
+        return False
+    refresh(wait=True)
+    _reconcile()
+    with _lock:
+        if not _doc_lengths and not _deleted:
+            return False
+        publish()
+    return True
+
+
+def is_ready():
+    return _base is not None
+
+
+def ensure_ready():
+    #Opens the latest snapshot (the writer builds the first one); searches never refresh, keep_in_sync does
+    if _base is None:
+        with _lock:
+            #Another thread may have finished while we waited for the lock
+            if _base is None and not _open_current():
+                if not _writer:
+                    raise IndexNotReadyError("The search index is still being built, try again shortly")
+                build()
+
+
+def keep_in_sync(retry_seconds=5):
+    #Background thread of every process: open (or, for the writer, build) the index before the
+    #first search, then pick up other processes' writes every SEARCH_INDEX_REFRESH_SECONDS
+    while True:
+        try:
+            if _base is None:
+                ensure_ready()
+            else:
+                refresh()
+        except IndexNotReadyError:
+            pass
+        except Exception as e:
+            logging.error(f"Search index sync failed: {e}")
+        time.sleep(retry_seconds if _base is None else SEARCH_INDEX_REFRESH_SECONDS)
+
+
+def parse_query(query):
+    phrases = [tokenize(phrase) for phrase in PHRASE_RE.findall(query)]
+    phrases = [phrase for phrase in phrases if phrase]
+    terms = tokenize(PHRASE_RE.sub(" ", query))
+    for phrase in phrases:
+        terms += phrase
+    return list(dict.fromkeys(terms)), phrases
+
+
+def _phrase_at(first, rest):
+    return any(all(start + offset + 1 in positions for offset, positions in enumerate(rest)) for start in first)
+
+
+def _has_phrase(doc_id, phrase):
+    first = _postings.get(phrase[0], {}).get(doc_id)
+    if first is None:
+        return False
+    rest = []
+    for term in phrase[1:]:
+        term_positions = _postings.get(term, {}).get(doc_id)
+        if term_positions is None:
+            return False
+        rest.append(set(term_positions))
+    return _phrase_at(first, rest)
+
+
+def _base_phrase_ranges(phrase):
+    #Snapshot posting range of every word in the phrase, or None if one of them isn't there
+    ranges = [_base.find_term(term) for term in phrase]
+    return None if None in ranges else ranges
+
+
+def _base_has_phrase(number, ranges):
+    positions = []
+    for start, end in ranges:
+        posting = bisect.bisect_left(_base.posting_docs, number, start, end)
+        if posting == end or _base.posting_docs[posting] != number:
+            return False
+        positions.append(_base.term_positions(posting))
+    return _phrase_at(positions[0], [set(term_positions) for term_positions in positions[1:]])
+
+
+def _phrase_docs(phrase_ranges):
+    #Snapshot doc numbers that have every word of every phrase, ahead of the position checks
+    docs = None
+    for start, end in (term_range for ranges in phrase_ranges for term_range in ranges):
+        term_docs = set(_base.posting_docs[start:end])
+        docs = term_docs if docs is None else docs & term_docs
+    return docs
+
+
+def _score_base(ranges, idfs, average_length):
+    #{doc number: BM25 score} over the snapshot, vectorized when NumPy is there
+    if np is not None:
+        scores = np.zeros(_base.n_docs, dtype=np.float64)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * _base.np_lengths / average_length)
+        for (start, end), idf in zip(ranges, idfs):
+            docs = _base.np_posting_docs[start:end]
+            tf = (_base.np_position_offsets[start + 1:end + 1] - _base.np_position_offsets[start:end]).astype(np.float64)
+            #A document appears once per term, so plain fancy-index adds are safe
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norms[docs])
+        if _deleted:
+            scores[list(_deleted.values())] = 0.0
+        matched = np.flatnonzero(scores)
+        return dict(zip(matched.tolist(), scores[matched].tolist()))
+
+    scores = defaultdict(float)
+    for (start, end), idf in zip(ranges, idfs):
+        for posting in range(start, end):
+            number = _base.posting_docs[posting]
+            tf = _base.position_offsets[posting + 1] - _base.position_offsets[posting]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * _base.lengths[number] / average_length)
+            scores[number] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+    for number in _deleted.values():
+        scores.pop(number, None)
+    return scores
+
+
+def search(query, limit=10):
+    #Returns [(doc id, score)] best first
+    terms, phrases = parse_query(query)
+    if not terms:
+        return []
+
+    with _lock:
+        base = _base
+        total_docs = (base.n_docs if base else 0) - len(_deleted) + len(_doc_lengths)
+        if total_docs <= 0:
+            return []
+        average_length = max(((base.total_length if base else 0) - _deleted_length + _total_length) / total_docs, 1)
+
+        ranges = []
+        idfs = []
+        memory_scores = defaultdict(float)
+        for term in terms:
+            found = base.find_term(term) if base else None
+            postings = _postings.get(term) or {}
+            #Documents deleted since the snapshot still count here, which barely moves the idf
+            df = (found[1] - found[0] if found else 0) + len(postings)
+            if not df:
+                continue
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            if found:
+                ranges.append(found)
+                idfs.append(idf)
+            for doc_id, positions in postings.items():
+                tf = len(positions)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * _doc_lengths[doc_id] / average_length)
+                memory_scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        base_scores = _score_base(ranges, idfs, average_length) if ranges else {}
+
+        phrase_ranges = []
+        if phrases and base_scores:
+            phrase_ranges = [_base_phrase_ranges(phrase) for phrase in phrases]
+            docs = set() if None in phrase_ranges else _phrase_docs(phrase_ranges)
+            base_scores = {number: score for number, score in base_scores.items() if number in docs}
+
+        #Best first; phrase positions are only checked until we have enough hits
+        candidates = [(score, number, None) for number, score in base_scores.items()]
+        candidates += [(score, -1, doc_id) for doc_id, score in memory_scores.items()]
+        if not phrases and len(candidates) > limit:
+            candidates = sorted(candidates, reverse=True)[:limit]
+        else:
+            candidates.sort(reverse=True)
+        ranked = []
+        for score, number, doc_id in candidates:
+            if doc_id is None:
+                if not all(_base_has_phrase(number, ranges) for ranges in phrase_ranges):
+                    continue
+                doc_id = base.doc_id(number)
+            elif phrases and not all(_has_phrase(doc_id, phrase) for phrase in phrases):
+                continue
+            ranked.append((doc_id, score))
+            if len(ranked) == limit:
+                break
+    return ranked
+
+
+def related(doc_id, limit=5):
+    #Returns [(doc id, cosine similarity)] for the lectures closest to doc_id
+    if np is None:
+        raise RuntimeError("Related lectures need NumPy installed")
+    doc_id = str(doc_id)
+    with _lock:
+        base = _base
+        number = base.find_doc(doc_id) if base is not None and base.vectors is not None else None
+        if doc_id in _vector_rows:
+            vector = _vectors[_vector_rows[doc_id]]
+        elif number is not None and doc_id not in _deleted:
+            vector = base.vectors[number]
+        else:
+            return []
+
+        hits = []
+        if base is not None and base.vectors is not None and base.n_docs:
+            similarities = base.vectors @ vector
+            hidden = list(_deleted.values()) + ([number] if number is not None else [])
+            similarities[hidden] = -1.0
+            top = np.argsort(-similarities)[:limit]
+            hits += [(base.doc_id(int(i)), float(similarities[i])) for i in top]
+        if _row_ids:
+            similarities = _vectors[:len(_row_ids)] @ vector
+            if doc_id in _vector_rows:
+                similarities[_vector_rows[doc_id]] = -1.0
+            top = np.argsort(-similarities)[:limit]
+            hits += [(_row_ids[int(i)], float(similarities[i])) for i in top]
+    hits.sort(key=lambda hit: hit[1], reverse=True)
+    return [hit for hit in hits if hit[1] > 0][:limit]
+
+
+def snippet(text, query):
+    #A window of text around the first match with every query word wrapped in <mark>
+    terms, _ = parse_query(query)
+    if not text or not terms:
+        return ""
+    pattern = re.compile(r"\b(" + "|".join(re.escape(term) for term in terms) + r")\b", re.IGNORECASE)
+    match = pattern.search(text)
+    if match is None:
+        return ""
+    start = max(0, match.start() - SNIPPET_CHARS // 2)
+    end = min(len(text), match.end() + SNIPPET_CHARS // 2)
+    window = text[start:end]
+    #Escape the text between matches separately so we never mark inside an HTML entity
+    pieces = []
+    last = 0
+    for m in pattern.finditer(window):
+        pieces.append(html.escape(window[last:m.start()]))
+        pieces.append(f"<mark>{html.escape(m.group(0))}</mark>")
+        last = m.end()
+    pieces.append(html.escape(window[last:]))
+    return ("…" if start else "") + "".join(pieces) + ("…" if end < len(text) else "")
@@ -0,0 +1,72 @@
+#Subject -> Class -> Topic tree for the sidebar.
+#Built with one aggregation that only touches the grouping fields, so transcripts never
+#leave Mongo. The result is cached in memory next to a version number kept in the
+#CacheVersions collection: invalidate() bumps it whenever documents are added or deleted,
+#and every server process checks it (one lookup by _id) before reusing its cached tree.
+#The max age only covers writes made without invalidate(), e.g. by hand in the database.
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+
+from config.db import db
+
+STRUCTURE_CACHE_SECONDS = int(os.getenv("STRUCTURE_CACHE_SECONDS", "300"))
+VERSION_KEY = "structure"
+
+STRUCTURE_PIPELINE = [
+    {"$match": {"subject": {"$nin": [None, ""]}, "class": {"$nin": [None, ""]}, "topic": {"$nin": [None, ""]}}},
+    {"$group": {
+        "_id": {"subject": "$subject", "class": "$class", "topic": "$topic"},
+        "count": {"$sum": 1},
+        "latestUpload": {"$max": "$uploadDate"},
+    }},
+    {"$sort": {"_id.subject": 1, "_id.class": 1, "_id.topic": 1}},
+]
+
+_lock = Lock()
+#(tree, etag, built at, version)
+_cache = None
+
+
+def _version():
+    entry = db.CacheVersions.find_one({"_id": VERSION_KEY})
+    return entry["version"] if entry else 0
+
+
+def build_structure():
+    tree = {}
+    for row in db.Documents.aggregate(STRUCTURE_PIPELINE):
+        key = row["_id"]
+        latest = row.get("latestUpload")
+        classes = tree.setdefault(key["subject"], {})
+        topics = classes.setdefault(key["class"], {})
+        topics[key["topic"]] = {
+            "count": row["count"],
+            "latestUpload": latest.isoformat() if latest else None,
+        }
+    return tree
+
+
+def get_structure():
+    global _cache
+    #Read before building, so a write that lands during the build makes the next call rebuild
+    version = _version()
+    with _lock:
+        if _cache is not None and _cache[3] == version and time.monotonic() - _cache[2] < STRUCTURE_CACHE_SECONDS:
+            return _cache[0], _cache[1]
+
+    tree = build_structure()
+    etag = hashlib.sha1(json.dumps(tree, sort_keys=True).encode("utf-8")).hexdigest()
+    with _lock:
+        _cache = (tree, etag, time.monotonic(), version)
+    return tree, etag
+
+
+def invalidate():
+    #Drops the tree in every server process, not just this one
+    global _cache
+    db.CacheVersions.update_one({"_id": VERSION_KEY}, {"$inc": {"version": 1}}, upsert=True)
+    with _lock:
+        _cache = None
@@ -0,0 +1,198 @@
+#Compressed transcript store.
+#Transcripts are by far the biggest part of a lecture, yet /content only needs them when the
+#user expands one, so they live in the Transcripts side collection instead of on Documents.
+#Each transcript is cut into pages of TRANSCRIPT_PAGE_CHARS characters and every page is
+#compressed on its own (zstd when the zstandard package is installed, zlib otherwise), so
+#/transcript/<id>?page=n only has to fetch and decompress one page. save_stream() takes the
+#text in pieces (e.g. PDF pages as they're read) and compresses page by page, and iter_text()
+#hands it back the same way, so neither has to hold the whole transcript.
+#Documents written before this still carry an inline transcript; they are read from there
+#until migrate() moves them over:
+#    python -m services.transcripts
+import logging
+import os
+import zlib
+from datetime import datetime
+
+from bson import Binary, ObjectId
+from pymongo import ReplaceOne
+
+from config.db import db
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TRANSCRIPT_PAGE_CHARS = int(os.getenv("TRANSCRIPT_PAGE_CHARS", "20000"))
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+CODEC = "zstd" if zstandard is not None else "zlib"
+MIGRATE_BATCH_SIZE = 100
+
+
+def compress(data, codec=CODEC):
+    if codec == "zstd":
+        #Compressor objects aren't thread safe, they're cheap enough to make per call
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This transcript is zstd compressed, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def iter_pages(pieces, page_chars=TRANSCRIPT_PAGE_CHARS):
+    #Cuts text that arrives in pieces into pages of page_chars characters. Walks each piece with
+    #an offset, so one huge piece is sliced once per page instead of copied over and over
+    buffer = ""
+    for piece in pieces:
+        offset = 0
+        if buffer:
+            offset = page_chars - len(buffer)
+            if len(piece) < offset:
+                buffer += piece
+                continue
+            yield buffer + piece[:offset]
+        while len(piece) - offset >= page_chars:
+            yield piece[offset:offset + page_chars]
+            offset += page_chars
+        buffer = piece[offset:]
+    if buffer:
+        yield buffer
+
+
+def split_pages(text, page_chars=TRANSCRIPT_PAGE_CHARS):
+    return list(iter_pages([text], page_chars)) or [""]
+
+
+def _record(document_id, pieces):
+    pages = []
+    length = 0
+    for page in iter_pages(pieces):
+        pages.append(Binary(compress(page.encode("utf-8"))))
+        length += len(page)
+    pages = pages or [Binary(compress(b""))]
+    return {
+        "_id": ObjectId(document_id),
+        "codec": CODEC,
+        "length": length,
+        "pageChars": TRANSCRIPT_PAGE_CHARS,
+        "pageCount": len(pages),
+        "pages": pages,
+        "createdAt": datetime.now(),
+    }
+
+
+def save(document_id, text):
+    return save_stream(document_id, [text or ""])
+
+
+def save_stream(document_id, pieces):
+    #Replaces whatever was stored for this document, so a retried stage can call it again.
+    #Only the compressed pages are kept in memory, never the whole text
+    record = _record(document_id, pieces)
+    db.Transcripts.replace_one({"_id": record["_id"]}, record, upsert=True)
+    return _summary(record)
+
+
+def _summary(record):
+    #Stored on the document so the client knows there's a transcript without fetching it
+    return {"transcriptLength": record["length"], "transcriptPages": record["pageCount"]}
+
+
+def summary(document_id):
+    #The same summary for a transcript already in the store, or None; doesn't load the pages
+    record = db.Transcripts.find_one({"_id": ObjectId(document_id)}, {"length": 1, "pageCount": 1})
+    return _summary(record) if record is not None else None
+
+
+def _join(record):
+    return "".join(decompress(page, record["codec"]).decode("utf-8") for page in record["pages"])
+
+
+def load(document_id):
+    #Full text, or None if the document has no transcript
+    return load_many([document_id]).get(str(document_id))
+
+
+def load_many(document_ids):
+    #{doc id: full text}, falling back to inline transcripts on documents not migrated yet
+    ids = [ObjectId(doc_id) for doc_id in document_ids]
+    texts = {str(record["_id"]): _join(record) for record in db.Transcripts.find({"_id": {"$in": ids}})}
+    missing = [doc_id for doc_id in ids if str(doc_id) not in texts]
+    if missing:
+        for doc in db.Documents.find({"_id": {"$in": missing}, "transcript": {"$exists": True}}, {"transcript": 1}):
+            texts[str(doc["_id"])] = doc["transcript"] or ""
+    return texts
+
+
+def iter_text(document_id):
+    #The transcript one page at a time, decompressed as it's consumed; nothing if there's none
+    record = db.Transcripts.find_one({"_id": ObjectId(document_id)}, {"codec": 1, "pages": 1})
+    if record is None:
+        text = load(document_id)
+        if text:
+            yield text
+        return
+    for page in record["pages"]:
+        yield decompress(page, record["codec"]).decode("utf-8")
+
+
+def get_page(document_id, page):
+    #{"page", "pages", "length", "text"}, or None if there's no transcript or no such page
+    record = db.Transcripts.find_one(
+        {"_id": ObjectId(document_id)},
+        {"codec": 1, "length": 1, "pageCount": 1, "pages": {"$slice": [page, 1]}},
+    )
+    if record is not None:
+        if not record["pages"]:
+            return None
+        text = decompress(record["pages"][0], record["codec"]).decode("utf-8")
+        return {"page": page, "pages": record["pageCount"], "length": record["length"], "text": text}
+
+    doc = db.Documents.find_one({"_id": ObjectId(document_id), "transcript": {"$exists": True}}, {"transcript": 1})
+    if doc is None:
+        return None
+    pages = split_pages(doc["transcript"] or "")
+    if page >= len(pages):
+        return None
+    return {"page": page, "pages": len(pages), "length": len(doc["transcript"] or ""), "text": pages[page]}
+
+
+def delete(document_ids):
+    db.Transcripts.delete_many({"_id": {"$in": [ObjectId(doc_id) for doc_id in document_ids]}})
+
+
+def _flush(batch):
+    db.Transcripts.bulk_write([ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in batch], ordered=False)
+    #Only drop the inline copy once the compressed one is safely written
+    for record in batch:
+        db.Documents.update_one({"_id": record["_id"]}, {"$unset": {"transcript": ""}, "$set": _summary(record)})
+
+
+def migrate():
+    #Moves inline transcripts off Documents, safe to stop and run again
+    moved = 0
+    batch = []
+    for doc in db.Documents.find({"transcript": {"$exists": True}}, {"transcript": 1}).batch_size(MIGRATE_BATCH_SIZE):
+        batch.append(_record(doc["_id"], [doc["transcript"] or ""]))
+        if len(batch) == MIGRATE_BATCH_SIZE:
+            _flush(batch)
+            moved += len(batch)
+            batch = []
+    if batch:
+        _flush(batch)
+        moved += len(batch)
+    if moved:
+        logging.info(f"Moved {moved} transcript(s) to the compressed store ({CODEC})")
+    return moved
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"✅ Moved {migrate()} transcript(s) to the compressed store ({CODEC})")
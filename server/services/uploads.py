@@ -0,0 +1,171 @@
+#Resumable chunked uploads for big lecture files.
+#The client opens a session, PUTs fixed-size chunks (in any order, each with its SHA-256)
+#and the chunks are streamed straight into a preallocated .part file at their offset.
+#Session state lives in the UploadSessions collection, so after a dropped connection the
+#client asks which chunks are missing and only sends those. When the last chunk lands the
+#file is renamed into place and handed to the upload pipeline.
+import hashlib
+import os
+import uuid
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+from config.db import db
+
+UPLOAD_FOLDER = 'uploads'
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(8 * 1024 * 1024 * 1024)))
+STREAM_READ_SIZE = 64 * 1024
+
+OPEN = "open"
+COMPLETED = "completed"
+
+
+class UploadError(Exception):
+    #Carries the HTTP status the endpoint should answer with
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def part_path(upload_id, ext):
+    return os.path.join(UPLOAD_FOLDER, f"{upload_id}.{ext}.part")
+
+
+def final_path(upload_id, ext):
+    return os.path.join(UPLOAD_FOLDER, f"{upload_id}.{ext}")
+
+
+def create_session(filename, ext, size, chunk_size=None, sha256=None):
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    if not 0 < size <= MAX_UPLOAD_SIZE:
+        raise UploadError(f"File size must be between 1 byte and {MAX_UPLOAD_SIZE} bytes", 413)
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise UploadError(f"Chunk size must be between 1 byte and {MAX_CHUNK_SIZE} bytes")
+
+    upload_id = uuid.uuid4().hex
+    path = part_path(upload_id, ext)
+    #Reserve the full size up front so every chunk can be written at its own offset
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+    now = datetime.now()
+    session = {
+        "_id": upload_id,
+        "filename": filename,
+        "ext": ext,
+        "size": size,
+        "chunkSize": chunk_size,
+        "totalChunks": (size + chunk_size - 1) // chunk_size,
+        "received": [],
+        "sha256": sha256,
+        "status": OPEN,
+        "jobId": None,
+        "createdAt": now,
+        "updatedAt": now,
+    }
+    db.UploadSessions.insert_one(session)
+    return session
+
+
+def get_session(upload_id):
+    session = db.UploadSessions.find_one({"_id": upload_id})
+    if session is None:
+        raise UploadError("Upload not found", 404)
+    return session
+
+
+def missing_chunks(session):
+    received = set(session["received"])
+    return [index for index in range(session["totalChunks"]) if index not in received]
+
+
+def write_chunk(upload_id, index, stream, expected_sha256):
+    session = get_session(upload_id)
+    if session["status"] != OPEN:
+        raise UploadError("Upload is already complete", 409)
+    if not 0 <= index < session["totalChunks"]:
+        raise UploadError(f"Chunk index must be between 0 and {session['totalChunks'] - 1}")
+    if not expected_sha256:
+        raise UploadError("Missing X-Chunk-Sha256 header")
+
+    offset = index * session["chunkSize"]
+    expected_length = min(session["chunkSize"], session["size"] - offset)
+    digest = hashlib.sha256()
+    written = 0
+    #Copy the request body to disk piece by piece, the chunk is never held in memory
+    with open(part_path(upload_id, session["ext"]), "r+b") as f:
+        f.seek(offset)
+        while written < expected_length:
+            piece = stream.read(min(STREAM_READ_SIZE, expected_length - written))
+            if not piece:
+                break
+            digest.update(piece)
+            f.write(piece)
+            written += len(piece)
+
+    if written != expected_length or stream.read(1):
+        raise UploadError(f"Chunk {index} should be {expected_length} bytes")
+    if digest.hexdigest() != expected_sha256.lower():
+        #The bad bytes stay on disk but the chunk isn't marked received, so the client resends it
+        raise UploadError(f"Checksum mismatch for chunk {index}", 422)
+
+    return db.UploadSessions.find_one_and_update(
+        {"_id": upload_id},
+        {"$addToSet": {"received": index}, "$set": {"updatedAt": datetime.now()}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for piece in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+def finish(upload_id):
+    #Returns the path of the assembled file, or None if another request already finished it
+    session = get_session(upload_id)
+    missing = missing_chunks(session)
+    if missing:
+        raise UploadError(f"{len(missing)} chunk(s) still missing", 409)
+
+    #Only one request gets to flip the session, so the pipeline starts exactly once
+    claimed = db.UploadSessions.find_one_and_update(
+        {"_id": upload_id, "status": OPEN},
+        {"$set": {"status": COMPLETED, "updatedAt": datetime.now()}},
+    )
+    if claimed is None:
+        return None
+
+    part = part_path(upload_id, session["ext"])
+    if session.get("sha256") and _file_sha256(part) != session["sha256"].lower():
+        db.UploadSessions.update_one({"_id": upload_id}, {"$set": {"status": OPEN, "received": []}})
+        raise UploadError("Whole-file checksum mismatch, please upload the chunks again", 422)
+
+    path = final_path(upload_id, session["ext"])
+    os.replace(part, path)
+    return path
+
+
+def set_job(upload_id, job_id):
+    db.UploadSessions.update_one({"_id": upload_id}, {"$set": {"jobId": job_id}})
+
+
+def serialize_session(session):
+    missing = missing_chunks(session)
+    return {
+        "upload_id": session["_id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "chunkSize": session["chunkSize"],
+        "totalChunks": session["totalChunks"],
+        "receivedChunks": len(session["received"]),
+        "missingChunks": missing,
+        "status": session["status"],
+        "job_id": session.get("jobId"),
+    }
@@ -0,0 +1,44 @@
+#Every query shape in config.indexes.QUERY_SHAPES must be served by an index.
+#Needs a reachable mongod (MONGO_URI, default localhost) and is skipped without one; it works
+#in a scratch database that is dropped afterwards.
+#    python -m pytest tests/test_query_plans.py
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pymongo = pytest.importorskip("pymongo")
+pytest.importorskip("dotenv")
+
+from config import indexes
+
+
+@pytest.fixture(scope="module")
+def scratch_db():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"), serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError as e:
+        pytest.skip(f"No MongoDB to check query plans against: {e}")
+    name = f"studyez_query_plans_{uuid.uuid4().hex[:8]}"
+    database = client[name]
+    indexes.ensure_indexes(database)
+    yield database
+    client.drop_database(name)
+    client.close()
+
+
+@pytest.mark.parametrize("name", sorted(indexes.QUERY_SHAPES))
+def test_query_shape_uses_an_index(scratch_db, name):
+    stages = indexes.explain_stages(indexes.QUERY_SHAPES[name], scratch_db)
+    assert "COLLSCAN" not in stages, f"{name} falls back to a collection scan: {' -> '.join(stages)}"
+
+
+def test_every_shape_collection_has_indexes(scratch_db):
+    #A shape on a collection nobody creates indexes for would explain as EOF and pass vacuously
+    for name, shape in indexes.QUERY_SHAPES.items():
+        collection = shape.get("collection", "Documents")
+        assert len(scratch_db[collection].index_information()) > 1, f"{name}: no indexes on {collection}"
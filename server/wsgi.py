@@ -0,0 +1,21 @@
+#Production entry point, used by gunicorn (see gunicorn.conf.py):
+#    gunicorn -c gunicorn.conf.py
+#Also times how long the app takes to import, i.e. a worker's cold start, and warns when
+#that goes over STARTUP_BUDGET_SECONDS. python -m benchmarks.bench_startup checks the same budget.
+import logging
+import os
+import time
+
+_import_started = time.perf_counter()
+
+from app import app  # noqa: E402
+from services import metrics  # noqa: E402
+
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "2"))
+
+startup_seconds = time.perf_counter() - _import_started
+metrics.STARTUP_SECONDS.set(round(startup_seconds, 3))
+if startup_seconds > STARTUP_BUDGET_SECONDS:
+    logging.warning(f"Worker {os.getpid()} took {startup_seconds:.2f}s to start, budget is {STARTUP_BUDGET_SECONDS}s")
+else:
+    logging.info(f"Worker {os.getpid()} started in {startup_seconds:.2f}s")